@@ -0,0 +1,30 @@
+import asyncio
+import socket
+import time
+
+# Helpers shared by the bench_taskNN.py benchmarks.
+
+
+def percentile(data: list[float], q: float) -> float:
+    if not data:
+        return 0.0
+    return data[min(len(data) - 1, int(q * len(data)))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(address: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(address, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
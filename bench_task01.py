@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+from bench_common import free_port, percentile, wait_for_port
+
+# Load generator and latency benchmark for 01. Prime Time.
+#
+#   $ python bench_task01.py --connections 50 --requests 200000 \
+#         --mix small=90,large=5,float=4,malformed=1 --output run.json
+#
+# Unless --port is given, task01.py is started locally on a free port with
+# the current environment (so PRIME_MODE etc. apply to the server).
+
+# a few primes beyond the sieve and the deterministic Miller-Rabin range
+large_primes = [2**61 - 1, 2**89 - 1, 2**107 - 1, 2**127 - 1, 2**521 - 1]
+malformed_lines = [
+    b'{"method":"isPrime","number":"7"}\n',
+    b'{"method":"isComposite","number":7}\n',
+    b'{"number":7}\n',
+    b'not json\n',
+]
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights: dict[str, int] = {}
+    for tok in mix.split(","):
+        kind, _, weight = tok.partition("=")
+        if kind not in ("small", "large", "float", "malformed"):
+            raise ValueError(f"invalid request kind: {kind}")
+        weights[kind] = int(weight)
+    return weights
+
+
+def gen_request(kind: str) -> bytes:
+    if kind == "malformed":
+        return random.choice(malformed_lines)
+
+    if kind == "small":
+        num: int | float = random.randrange(1_000_000)
+    elif kind == "large":
+        num = random.choice(large_primes)
+    else:
+        num = random.randrange(1_000_000) + 0.5
+
+    return json.dumps({"method": "isPrime", "number": num}).encode() + b"\n"
+
+
+class Client:
+
+    def __init__(self, address: str, port: int, pipeline: int,
+                 weights: dict[str, int]) -> None:
+        self.address = address
+        self.port = port
+        self.pipeline = pipeline
+        self.kinds = list(weights)
+        self.weights = list(weights.values())
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.connects = 0
+
+    async def run(self, requests: int) -> None:
+        reader, writer = await self.connect()
+
+        while requests > 0:
+            kinds = random.choices(self.kinds, self.weights,
+                                   k=min(self.pipeline, requests))
+            if "malformed" in kinds:
+                # the server closes the connection after the error.
+                kinds = kinds[:kinds.index("malformed") + 1]
+
+            writer.writelines([gen_request(kind) for kind in kinds])
+            start = time.perf_counter()
+            await writer.drain()
+
+            for kind in kinds:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("unexpected eof")
+
+                self.latencies.append(time.perf_counter() - start)
+                if kind == "malformed":
+                    self.errors += 1
+
+            requests -= len(kinds)
+
+            if kinds[-1] == "malformed":
+                writer.close()
+                reader, writer = await self.connect()
+
+        writer.close()
+
+    async def connect(self) -> tuple[asyncio.StreamReader,
+                                     asyncio.StreamWriter]:
+        self.connects += 1
+        return await asyncio.open_connection(self.address, self.port)
+
+
+def start_server(port: int) -> subprocess.Popen[bytes]:
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "task01.py")
+    env = dict(os.environ, SOCKET_ADDRESS="127.0.0.1", TCP_PORT=str(port))
+    env.pop("DEBUG", None)
+    return subprocess.Popen([sys.executable, server],
+                            env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+async def main(args: argparse.Namespace) -> dict[str, object]:
+    weights = parse_mix(args.mix)
+    port = args.port or free_port()
+    server = None if args.port else start_server(port)
+
+    try:
+        await wait_for_port(args.address, port, 10)
+
+        clients = [
+            Client(args.address, port, args.pipeline, weights)
+            for _ in range(args.connections)
+        ]
+        share, extra = divmod(args.requests, args.connections)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client.run(share + (i < extra))
+                               for i, client in enumerate(clients)))
+        elapsed = time.perf_counter() - start
+
+    finally:
+        if server:
+            # an interrupt lets the server shut its process pool down.
+            server.send_signal(signal.SIGINT)
+            server.wait()
+
+    latencies = sorted(lat for client in clients for lat in client.latencies)
+    return {
+        "config": {
+            "connections": args.connections,
+            "requests": args.requests,
+            "pipeline": args.pipeline,
+            "mix": weights,
+            "server_mode": os.getenv("PRIME_MODE", "line"),
+        },
+        "elapsed_s": elapsed,
+        "responses": len(latencies),
+        "errors": sum(client.errors for client in clients),
+        "connects": sum(client.connects for client in clients),
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prime Time benchmark")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port",
+                        type=int,
+                        default=0,
+                        help="use a running server instead of starting one")
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--pipeline",
+                        type=int,
+                        default=100,
+                        help="requests in flight per connection")
+    parser.add_argument("--mix",
+                        default="small=90,large=5,float=4,malformed=1",
+                        help="weights of small,large,float,malformed")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from bench_common import free_port, percentile, wait_for_port
+
+# Fan-out benchmark for 03. Budget Chat.
+#
+#   $ python bench_task03.py --members 500 --slow 25 --senders 20 \
+#         --rate 200 --duration 10 --output run.json
+#
+# Unless --port is given, task03.py is started locally on a free port with
+# the current environment (so CHAT_WORKERS, CHAT_OVERFLOW etc. apply).
+# Every message carries its send time, latency is measured by the members
+# that read as fast as they can; slow members read a little at a time.
+
+
+def process_rss(pid: int) -> int:
+    # resident memory of the process and all its descendants (workers) in
+    # bytes, Linux only.
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next((int(line.split()[1]) * 1024
+                        for line in f if line.startswith("VmRSS:")), 0)
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return 0
+
+    return rss + sum(process_rss(child) for child in children)
+
+
+class Member:
+
+    def __init__(self, idx: int, slow: bool) -> None:
+        self.name = f"member{idx}"
+        self.slow = slow
+        self.received = 0
+        self.latencies: list[float] = []
+        self.disconnected = False
+
+    async def join(self, address: str, port: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(address, port)
+        await self.reader.readline()  # welcome
+        self.writer.write(f"{self.name}\n".encode())
+        await self.reader.readline()  # room contains
+
+    async def read(self, slow_delay: float) -> None:
+        try:
+            if self.slow:
+                await self.read_slow(slow_delay)
+            else:
+                await self.read_fast()
+        except ConnectionError:
+            pass
+        self.disconnected = True
+
+    async def read_fast(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+
+            now = time.perf_counter_ns()
+            if line.startswith(b"["):
+                # "[sender] <send time in ns>"
+                sent = int(line.rsplit(b" ", 1)[1])
+                self.latencies.append((now - sent) / 1e9)
+                self.received += 1
+
+    async def read_slow(self, slow_delay: float) -> None:
+        line_start = True  # the next chunk starts a new line
+        while True:
+            buf = await self.reader.read(1024)
+            if not buf:
+                return
+            self.received += buf.count(b"\n[")
+            self.received += line_start and buf.startswith(b"[")
+            line_start = buf.endswith(b"\n")
+            await asyncio.sleep(slow_delay)
+
+    async def send(self, count: int, interval: float) -> int:
+        sent = 0
+        next_send = time.perf_counter()
+        for _ in range(count):
+            if self.disconnected:
+                break
+
+            self.writer.write(f"{time.perf_counter_ns()}\n".encode())
+            sent += 1
+
+            next_send += interval
+            await asyncio.sleep(max(0, next_send - time.perf_counter()))
+
+        await self.writer.drain()
+        return sent
+
+
+def start_server(port: int) -> subprocess.Popen[bytes]:
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "task03.py")
+    env = dict(os.environ, SOCKET_ADDRESS="127.0.0.1", TCP_PORT=str(port))
+    env.pop("DEBUG", None)
+    return subprocess.Popen([sys.executable, server],
+                            env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+async def sample_rss(pid: int, samples: list[int]) -> None:
+    while True:
+        samples.append(process_rss(pid))
+        await asyncio.sleep(0.5)
+
+
+async def main(args: argparse.Namespace) -> dict[str, object]:
+    port = args.port or free_port()
+    server = None if args.port else start_server(port)
+    rss: list[int] = []
+
+    try:
+        await wait_for_port(args.address, port, 10)
+        sampler = asyncio.create_task(
+            sample_rss(server.pid, rss)) if server else None
+
+        members = [
+            Member(i, i < args.slow)
+            for i in range(args.members)
+        ]
+        random.shuffle(members)
+
+        limit = asyncio.Semaphore(50)
+
+        async def join(member: Member) -> None:
+            async with limit:
+                await member.join(args.address, port)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(join(member) for member in members))
+        join_time = time.perf_counter() - start
+
+        readers = [
+            asyncio.create_task(member.read(args.slow_delay))
+            for member in members
+        ]
+
+        senders = [member for member in members if not member.slow]
+        senders = senders[:args.senders]
+        per_sender = int(args.rate * args.duration / len(senders))
+        interval = len(senders) / args.rate
+
+        start = time.perf_counter()
+        sent = sum(await asyncio.gather(*(sender.send(per_sender, interval)
+                                          for sender in senders)))
+        # give the room a moment to deliver the tail of the messages.
+        await asyncio.sleep(args.settle)
+        elapsed = time.perf_counter() - start
+
+        for member in members:
+            member.writer.close()
+        for reader in readers:
+            reader.cancel()
+        if sampler:
+            sampler.cancel()
+
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    fast = [member for member in members if not member.slow]
+    slow = [member for member in members if member.slow]
+    latencies = sorted(lat for member in fast for lat in member.latencies)
+    delivered = sum(member.received for member in members)
+
+    return {
+        "config": {
+            "members": args.members,
+            "slow": args.slow,
+            "senders": len(senders),
+            "rate": args.rate,
+            "duration": args.duration,
+            "workers": int(os.getenv("CHAT_WORKERS", "1")),
+            "overflow": os.getenv("CHAT_OVERFLOW", "disconnect"),
+        },
+        "join_s": join_time,
+        "elapsed_s": elapsed,
+        "sent": sent,
+        "expected_deliveries": sent * (args.members - 1),
+        "delivered": delivered,
+        "delivered_per_s": delivered / elapsed,
+        "fast_delivered": sum(member.received for member in fast),
+        "slow_delivered": sum(member.received for member in slow),
+        "slow_disconnected": sum(member.disconnected for member in slow),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+        "server_rss_bytes": {
+            "start": rss[0] if rss else 0,
+            "peak": max(rss, default=0),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Budget Chat benchmark")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port",
+                        type=int,
+                        default=0,
+                        help="use a running server instead of starting one")
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--slow",
+                        type=int,
+                        default=10,
+                        help="members that read slowly")
+    parser.add_argument("--slow-delay",
+                        type=float,
+                        default=0.1,
+                        help="pause of the slow members between reads")
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--rate",
+                        type=float,
+                        default=100,
+                        help="messages per second of all the senders")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--settle",
+                        type=float,
+                        default=1,
+                        help="seconds to wait for deliveries after sending")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    args = parser.parse_args()
+    if args.slow >= args.members:
+        parser.error("--slow must be less than --members")
+    if args.senders < 1:
+        parser.error("--senders must be at least 1")
+
+    results = asyncio.run(main(args))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import string
+import subprocess
+import sys
+import time
+from typing import TypedDict
+
+import task03
+from bench_common import free_port, percentile, wait_for_port
+
+# Proxy overhead benchmark for 05. Mob in the Middle.
+#
+#   $ python bench_task05.py --members 50 --senders 10 --messages 5000 \
+#         --rate 500 --addresses 30 --output run.json
+#
+# A budget chat backend (task03) runs in this process on loopback, task05.py
+# is started in front of it with the current environment (so BE_POOL_SIZE
+# etc. apply) and the same traffic is run against the backend directly and
+# then through the proxy. --addresses is the percentage of messages that
+# carry a Boguscoin address.
+
+EVIL_ADDR = b"7YWHMfk9JZe0LM0g1ZauHuiSxhI"
+
+
+def gen_address() -> str:
+    chars = string.ascii_letters + string.digits
+    return "7" + "".join(random.choices(chars, k=random.randint(25, 34)))
+
+
+def gen_message(addresses: float) -> str:
+    if random.random() * 100 < addresses:
+        return f"please send the payment to {gen_address()} today"
+    return "hi there, what is the latest on the boguscoin price"
+
+
+class RunResult(TypedDict):
+    elapsed_s: float
+    sent: int
+    expected_deliveries: int
+    delivered: int
+    rewritten: int
+    delivered_per_s: float
+    connect_ms: dict[str, float]
+    latency_ms: dict[str, float]
+
+
+class Member:
+
+    def __init__(self, idx: int) -> None:
+        self.name = f"member{idx}"
+        self.received = 0
+        self.rewritten = 0
+        self.latencies: list[float] = []
+        # messages received per sender, for the senders' flow control
+        self.seen: dict[bytes, int] = {}
+        self.progress = asyncio.Event()
+
+    async def join(self, address: str, port: int) -> float:
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(address, port)
+        await self.reader.readline()  # welcome
+        elapsed = time.perf_counter() - start
+
+        self.writer.write(f"{self.name}\n".encode())
+        await self.reader.readline()  # room contains
+        return elapsed
+
+    async def read(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+
+            now = time.perf_counter_ns()
+            if line.startswith(b"["):
+                # "[sender] <send time in ns> <message>"
+                sender, sent, _ = line.split(b" ", 2)
+                self.latencies.append((now - int(sent)) / 1e9)
+                self.received += 1
+                self.rewritten += EVIL_ADDR in line
+                self.seen[sender] = self.seen.get(sender, 0) + 1
+                self.progress.set()
+
+    async def send(self, count: int, interval: float, addresses: float,
+                   observer: "Member", window: int) -> int:
+        tag = f"[{self.name}]".encode()
+        next_send = time.perf_counter()
+        for sent in range(1, count + 1):
+            msg = gen_message(addresses)
+            self.writer.write(f"{time.perf_counter_ns()} {msg}\n".encode())
+
+            if interval:
+                next_send += interval
+                await asyncio.sleep(max(0, next_send - time.perf_counter()))
+                continue
+
+            # as fast as possible, but at most window messages ahead of the
+            # observer so that the room queues stay bounded.
+            await self.writer.drain()
+            while sent - observer.seen.get(tag, 0) > window:
+                observer.progress.clear()
+                await observer.progress.wait()
+
+        await self.writer.drain()
+        return count
+
+
+async def run(args: argparse.Namespace, port: int) -> RunResult:
+    members = [Member(i) for i in range(args.members)]
+    limit = asyncio.Semaphore(50)
+
+    async def join(member: Member) -> float:
+        async with limit:
+            return await member.join(args.address, port)
+
+    connects = sorted(await asyncio.gather(*(join(m) for m in members)))
+    readers = [asyncio.create_task(member.read()) for member in members]
+
+    senders = members[:args.senders]
+    observer = members[-1]
+    per_sender = int(args.messages / len(senders))
+    interval = len(senders) / args.rate if args.rate else 0
+
+    start = time.perf_counter()
+    sent = sum(await asyncio.gather(*(
+        sender.send(per_sender, interval, args.addresses, observer,
+                    args.window) for sender in senders)))
+
+    # wait for the deliveries to settle.
+    expected = sent * (args.members - 1)
+    deadline = time.perf_counter() + args.settle
+    while (sum(m.received for m in members) < expected
+           and time.perf_counter() < deadline):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    for member in members:
+        member.writer.close()
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+
+    latencies = sorted(lat for m in members for lat in m.latencies)
+    delivered = sum(m.received for m in members)
+
+    return {
+        "elapsed_s": elapsed,
+        "sent": sent,
+        "expected_deliveries": expected,
+        "delivered": delivered,
+        "rewritten": sum(m.rewritten for m in members),
+        "delivered_per_s": delivered / elapsed,
+        "connect_ms": {
+            "p50": percentile(connects, 0.50) * 1000,
+            "p99": percentile(connects, 0.99) * 1000,
+        },
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+    }
+
+
+async def wait_for_empty_room(timeout: float) -> None:
+    # members of the previous run leave the backend room asynchronously.
+    deadline = time.monotonic() + timeout
+    while task03.chat and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def start_proxy(port: int, be_port: int) -> subprocess.Popen[bytes]:
+    proxy = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "task05.py")
+    env = dict(os.environ,
+               SOCKET_ADDRESS="127.0.0.1",
+               TCP_PORT=str(port),
+               BE_ADDRESS="127.0.0.1",
+               BE_PORT=str(be_port))
+    env.pop("DEBUG", None)
+    return subprocess.Popen([sys.executable, proxy],
+                            env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+async def main(args: argparse.Namespace) -> dict[str, object]:
+    # the backend logs to stdout, keep it for the results.
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr, force=True)
+
+    backend = await asyncio.start_server(task03.handler, args.address, 0)
+    be_port = backend.sockets[0].getsockname()[1]
+    port = free_port()
+    proxy = start_proxy(port, be_port)
+
+    try:
+        await wait_for_port(args.address, port, 10)
+
+        direct = await run(args, be_port)
+        await wait_for_empty_room(5)
+        proxied = await run(args, port)
+
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        await wait_for_empty_room(5)
+        backend.close()
+
+    def delta(key: str) -> float:
+        return proxied["latency_ms"][key] - direct["latency_ms"][key]
+
+    direct_rate = direct["delivered_per_s"]
+    proxied_rate = proxied["delivered_per_s"]
+
+    return {
+        "config": {
+            "members": args.members,
+            "senders": args.senders,
+            "messages": args.messages,
+            "rate": args.rate,
+            "window": args.window,
+            "addresses_pct": args.addresses,
+            "pool_size": int(os.getenv("BE_POOL_SIZE", "0")),
+        },
+        "direct": direct,
+        "proxy": proxied,
+        "overhead": {
+            "latency_p50_ms": delta("p50"),
+            "latency_p99_ms": delta("p99"),
+            "throughput_loss_pct":
+            (1 - proxied_rate / direct_rate) * 100 if direct_rate else 0.0,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mob in the Middle benchmark")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--messages",
+                        type=int,
+                        default=2000,
+                        help="messages of all the senders per run")
+    parser.add_argument("--rate",
+                        type=float,
+                        default=0,
+                        help="messages per second, as fast as possible if 0")
+    parser.add_argument("--window",
+                        type=int,
+                        default=20,
+                        help="messages in flight per sender if --rate is 0")
+    parser.add_argument("--addresses",
+                        type=float,
+                        default=20,
+                        help="percentage of messages with an address")
+    parser.add_argument("--settle",
+                        type=float,
+                        default=10,
+                        help="max seconds to wait for deliveries")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    args = parser.parse_args()
+    if args.senders >= args.members:
+        parser.error("--senders must be less than --members")
+
+    results = asyncio.run(main(args))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
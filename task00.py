@@ -1,11 +1,19 @@
 import asyncio
+import errno
+import fcntl
 import os
+import socket
 
 # 00. Smoke Test - https://protohackers.com/problem/0
 
 address = os.getenv("SOCKET_ADDRESS", "0.0.0.0")
 port = int(os.getenv("TCP_PORT", "8080"))
+# echo engine: "stream" (StreamReader/StreamWriter), "buffered"
+# (BufferedProtocol) or "splice" (Linux only, kernel pipe relay).
+mode = os.getenv("ECHO_MODE", "stream")
 bufsize = 100
+# receive buffer size of the buffered engine and pipe size of the splice one
+proto_bufsize = int(os.getenv("ECHO_BUFSIZE", "262144"))
 
 
 async def handle_echo(reader: asyncio.StreamReader,
@@ -23,11 +31,159 @@ async def handle_echo(reader: asyncio.StreamReader,
     writer.close()
 
 
+class EchoProtocol(asyncio.BufferedProtocol):
+    """echo engine receiving into a preallocated buffer"""
+
+    def __init__(self, size: int = proto_bufsize) -> None:
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert (isinstance(transport, asyncio.Transport))
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")
+        print(f"connected from {self.peer}")
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.view
+
+    def buffer_updated(self, nbytes: int) -> None:
+        # the transport either sends the data straight away or copies the
+        # unsent tail into its own buffer, so the view can be reused.
+        self.transport.write(self.view[:nbytes])
+
+    def eof_received(self) -> bool:
+        return False  # close the transport
+
+    def pause_writing(self) -> None:
+        # the peer does not read fast enough - stop reading until the
+        # write buffer drains below the low-water mark.
+        self.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        print(f'disconnected from {self.peer}')
+
+
+async def wait_fd(fd: int, writable: bool = False) -> None:
+    loop = asyncio.get_running_loop()
+    fut: asyncio.Future[None] = loop.create_future()
+
+    def ready() -> None:
+        if not fut.done():
+            fut.set_result(None)
+
+    if writable:
+        loop.add_writer(fd, ready)
+    else:
+        loop.add_reader(fd, ready)
+
+    try:
+        await fut
+
+    finally:
+        if writable:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def splice_echo(sock: socket.socket) -> None:
+    # socket -> pipe -> socket, so the payload never leaves the kernel.
+    loop = asyncio.get_running_loop()
+    peer = sock.getpeername()
+    fd = sock.fileno()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    rpipe, wpipe = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    handed_over = False  # the socket belongs to an asyncio transport
+    print(f"connected from {peer}")
+
+    try:
+        try:
+            fcntl.fcntl(wpipe, fcntl.F_SETPIPE_SZ, proto_bufsize)
+        except OSError:
+            pass  # keep the default pipe size
+
+        size = fcntl.fcntl(wpipe, fcntl.F_GETPIPE_SZ)
+        pending = 0  # bytes sitting in the pipe
+
+        try:
+            while True:
+                if pending == 0:
+                    try:
+                        n = os.splice(fd, wpipe, size, flags=flags)
+                    except BlockingIOError:
+                        await wait_fd(fd)
+                        continue
+
+                    if n == 0:
+                        break  # eof
+
+                    pending = n
+
+                try:
+                    pending -= os.splice(rpipe, fd, pending, flags=flags)
+                except BlockingIOError:
+                    await wait_fd(fd, writable=True)
+
+        except OSError as e:
+            if pending == 0 and e.errno == errno.EINVAL:
+                # the socket does not support splicing - hand it over to
+                # the asyncio engine instead.
+                print(f"splice is not supported for {peer}: {e}")
+                await loop.connect_accepted_socket(EchoProtocol, sock)
+                handed_over = True
+                return
+
+            print(f"error: {e}")
+
+        print(f'disconnected from {peer}')
+
+    finally:
+        # also on cancellation or unexpected errors.
+        os.close(rpipe)
+        os.close(wpipe)
+        if not handed_over:
+            sock.close()
+
+
+async def serve_splice() -> None:
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task[None]] = set()
+
+    with socket.create_server((address, port)) as server:
+        server.setblocking(False)
+        print(f"Serving on {server.getsockname()} ({mode})")
+
+        while True:
+            conn, _ = await loop.sock_accept(server)
+            conn.setblocking(False)
+
+            task = asyncio.create_task(splice_echo(conn))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+
 async def main() -> None:
-    server = await asyncio.start_server(handle_echo, address, port)
+    global mode
+    loop = asyncio.get_running_loop()
+
+    if mode == "splice":
+        if hasattr(os, "splice") and hasattr(fcntl, "F_SETPIPE_SZ"):
+            return await serve_splice()
+
+        print("splice is not available, falling back to buffered")
+        mode = "buffered"
+
+    if mode == "buffered":
+        server = await loop.create_server(EchoProtocol, address, port)
+    else:
+        server = await asyncio.start_server(handle_echo, address, port)
 
     addr = ", ".join(str(sock.getsockname()) for sock in server.sockets)
-    print(f"Serving on {addr}")
+    print(f"Serving on {addr} ({mode})")
 
     async with server:
         await server.serve_forever()
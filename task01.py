@@ -1,9 +1,18 @@
 import asyncio
 import os
 import sys
-import json
 import math
+import multiprocessing
+import random
 import logging
+import signal
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+from task01_codec import (InvalidRequestError, get_error, get_response,
+                          parse_message)
 
 # 01. Prime Time - https://protohackers.com/problem/1
 
@@ -13,53 +22,228 @@ logging.basicConfig(
 
 address = os.getenv("SOCKET_ADDRESS", "0.0.0.0")
 port = int(os.getenv("TCP_PORT", "8080"))
+# Miller-Rabin rounds for numbers beyond the deterministic range.
+prime_rounds = int(os.getenv("PRIME_ROUNDS", "20"))
+# numbers below the limit are looked up in a sieve built at startup.
+sieve_limit = int(os.getenv("PRIME_SIEVE_LIMIT", "1048576"))
+# number of results for numbers above the sieve limit to remember.
+cache_size = int(os.getenv("PRIME_CACHE_SIZE", "16384"))
+# numbers with more bits than this are checked in a process pool.
+pool_bits = int(os.getenv("PRIME_POOL_BITS", "256"))
+pool_workers = int(os.getenv("PRIME_POOL_WORKERS", str(os.cpu_count() or 1)))
+# maximum number of pool jobs in flight per connection
+pool_inflight = int(os.getenv("PRIME_POOL_INFLIGHT", "4"))
+# request handling: "line" (one request per drain) or "batch" (every
+# complete line in the receive buffer per drain).
+mode = os.getenv("PRIME_MODE", "line")
+# read size and maximum pending request size of the batched handler
+read_size = 65536
+line_limit = 65536
+
+# primes for fast rejection of small factors
+small_primes = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53,
+                59, 61, 67, 71, 73, 79, 83, 89, 97)
+# testing against the first 13 primes is deterministic for n below this
+# bound (it covers all 64-bit integers).
+deterministic_bound = 3317044064679887385961981
+deterministic_bases = small_primes[:13]
+
+
+def is_prime(num: int | float) -> bool:
+    if isinstance(num, float):
+        # non-integers (including inf and nan) are never prime.
+        if not num.is_integer():
+            return False
+        num = int(num)
 
+    if num < 2:
+        return False
 
-class InvalidRequestError(ValueError):
-    pass
+    for p in small_primes:
+        if num % p == 0:
+            return num == p
 
+    if num < small_primes[-1]**2:
+        return True
 
-def parse_message(line: bytes) -> int:
-    try:
-        req = json.loads(line.decode())
-    except json.JSONDecodeError:
-        raise InvalidRequestError(f"invalid json: {line.decode()}")
+    if num < deterministic_bound:
+        return miller_rabin(num, deterministic_bases)
 
-    try:
-        method = req["method"]
-        num = req["number"]
-    except KeyError as e:
-        raise InvalidRequestError(f"Missing field: {e}")
+    bases = (random.randrange(2, num - 1) for _ in range(prime_rounds))
+    return miller_rabin(num, bases)
 
-    if method != "isPrime":
-        raise InvalidRequestError(f"invalid method: {method}")
 
-    if type(num) != int and type(num) != float:
-        raise InvalidRequestError("number field must be a number")
+def miller_rabin(num: int, bases: Iterable[int]) -> bool:
+    # num - 1 = d * 2^s with d odd
+    d, s = num - 1, 0
+    while d % 2 == 0:
+        d, s = d >> 1, s + 1
 
-    return int(num)
+    for a in bases:
+        x = pow(a, d, num)
+        if x == 1 or x == num - 1:
+            continue
 
+        for _ in range(s - 1):
+            x = pow(x, 2, num)
+            if x == num - 1:
+                break
+        else:
+            return False
 
-def get_response(is_prime: bool) -> bytes:
-    res = {"method": "isPrime", "prime": is_prime}
-    return f"{json.dumps(res)}\n".encode()
+    return True
 
 
-def get_error(err: str) -> bytes:
-    res = {"method": "error", "error": err}
-    return f"{json.dumps(res)}\n".encode()
+class PrimeSieve:
+    """odd-only bitset of the primes below the limit"""
 
+    # maps the 0/1 sieve flags to ascii digits of a binary number
+    binary = bytes.maketrans(b"\x00\x01", b"01")
 
-def is_prime(num: int) -> bool:
-    if num <= 1:
-        return False
+    def __init__(self, limit: int) -> None:
+        self.limit = max(limit, 3)
 
-    sqrt = math.sqrt(num)
-    for x in range(2, int(sqrt) + 1):
-        if num % x == 0:
-            return False
+        # flags[i] tells whether 2 * i + 1 is prime
+        flags = bytearray([1]) * (self.limit // 2)
+        flags[0] = 0
+        for i in range(1, (math.isqrt(self.limit) + 1) // 2):
+            if flags[i]:
+                p = 2 * i + 1
+                start = p * p // 2
+                flags[start::p] = bytes(len(range(start, len(flags), p)))
 
-    return True
+        # pack the flags 8 to a byte: bit i of the integer is flags[i].
+        bits = int(flags.translate(PrimeSieve.binary)[::-1], 2)
+        self.bits = bits.to_bytes((len(flags) + 7) // 8, "little")
+
+    def is_prime(self, num: int) -> bool:
+        assert (num < self.limit)
+
+        if num < 3 or num % 2 == 0:
+            return num == 2
+
+        i = num >> 1
+        return self.bits[i >> 3] >> (i & 7) & 1 == 1
+
+
+class PrimeCache:
+    """bounded LRU cache of primality results"""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.results: OrderedDict[int, bool] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, num: int) -> bool | None:
+        try:
+            res = self.results[num]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.results.move_to_end(num)
+        return res
+
+    def put(self, num: int, res: bool) -> None:
+        self.results[num] = res
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def __str__(self) -> str:
+        return (f"size:{len(self.results)}/{self.size} hits:{self.hits} "
+                f"misses:{self.misses}")
+
+
+class Primes:
+    """primality lookups shared by all connections"""
+
+    def __init__(self, sieve_limit: int, cache_size: int) -> None:
+        self.sieve = PrimeSieve(sieve_limit)
+        self.cache = PrimeCache(cache_size)
+        self.pending: dict[int, asyncio.Future[bool]] = {}
+        # number of requests waiting for each of the pending checks
+        self.waiters: dict[int, int] = {}
+
+    def is_prime(self, num: int | float) -> bool:
+        if isinstance(num, float):
+            if not num.is_integer():
+                return False
+            num = int(num)
+
+        if num < self.sieve.limit:
+            return self.sieve.is_prime(num)
+
+        res = self.cache.get(num)
+        if res is None:
+            res = is_prime(num)
+            self.cache.put(num, res)
+
+        return res
+
+    def is_expensive(self, num: int | float) -> bool:
+        return (pool is not None and isinstance(num, int)
+                and num.bit_length() > pool_bits)
+
+    async def check(self, num: int | float,
+                    inflight: asyncio.Semaphore) -> bool:
+        if not self.is_expensive(num):
+            return self.is_prime(num)
+
+        assert (pool is not None and isinstance(num, int))
+        res = self.cache.get(num)
+        if res is not None:
+            return res
+
+        # the same number requested concurrently is checked only once.
+        while (pending := self.pending.get(num)) is not None:
+            self.waiters[num] = self.waiters.get(num, 0) + 1
+            try:
+                return await asyncio.shield(pending)
+
+            except asyncio.CancelledError:
+                # the request that started the check went away, start
+                # another one unless this request is cancelled as well.
+                task = asyncio.current_task()
+                if not pending.cancelled() or task and task.cancelling():
+                    raise
+
+            finally:
+                self.waiters[num] -= 1
+                if not self.waiters[num]:
+                    del self.waiters[num]
+
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future[bool] = loop.create_future()
+        self.pending[num] = fut
+
+        try:
+            async with inflight:
+                res = await loop.run_in_executor(pool, is_prime, num)
+            self.cache.put(num, res)
+            fut.set_result(res)
+            return res
+
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+
+        except Exception as e:
+            # nobody would retrieve the exception otherwise.
+            if num in self.waiters:
+                fut.set_exception(e)
+            else:
+                fut.cancel()
+            raise
+
+        finally:
+            del self.pending[num]
+
+
+primes = Primes(sieve_limit, cache_size)
+# the pool for expensive checks is started by main.
+pool: ProcessPoolExecutor | None = None
 
 
 async def prime(reader: asyncio.StreamReader,
@@ -68,6 +252,7 @@ async def prime(reader: asyncio.StreamReader,
     log = logging.getLogger(peer)
 
     log.info("connected")
+    inflight = asyncio.Semaphore(pool_inflight)
 
     while not reader.at_eof():
         line = await reader.readline()
@@ -75,16 +260,16 @@ async def prime(reader: asyncio.StreamReader,
         if not line:
             break
 
-        log.debug(f"request: {line.decode()}")
+        log.debug(f"request: {line!r}")
 
         try:
             num = parse_message(line)
-            res = get_response(is_prime(num))
+            res = get_response(await primes.check(num, inflight))
             log.debug(f"response: {res.decode()}")
             writer.write(res)
 
         except InvalidRequestError as e:
-            log.error(f"error: {line.decode()}")
+            log.error(f"error: {line!r}")
             writer.write(get_error(str(e)))
             break
 
@@ -92,17 +277,92 @@ async def prime(reader: asyncio.StreamReader,
             await writer.drain()
 
     log.info("disconnected")
+    log.debug(f"cache: {primes.cache}")
+    writer.close()
+
+
+async def prime_batched(reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter) -> None:
+    peer = ":".join(str(tok) for tok in writer.get_extra_info("peername"))
+    log = logging.getLogger(peer)
+
+    log.info("connected")
+    inflight = asyncio.Semaphore(pool_inflight)
+
+    tail = b""
+    closed = False
+    while not closed:
+        buf = await reader.read(read_size)
+
+        if not buf:
+            # eof - the unterminated last line is still a request.
+            lines = [tail] if tail else []
+            closed = True
+        else:
+            *lines, tail = (tail + buf).split(b"\n")
+
+        # expensive checks run concurrently in the pool, the responses are
+        # still written in request order.
+        results: list[bool | asyncio.Task[bool]] = []
+        error: bytes | None = None
+        for line in lines:
+            try:
+                num = parse_message(line)
+                if primes.is_expensive(num):
+                    results.append(
+                        asyncio.create_task(primes.check(num, inflight)))
+                else:
+                    results.append(primes.is_prime(num))
+
+            except InvalidRequestError as e:
+                log.error(f"error: {line!r}")
+                error = get_error(str(e))
+                closed = True
+                break
+
+        if not closed and len(tail) > line_limit:
+            log.error(f"error: request is too long: {len(tail)}")
+            error = get_error("request is too long")
+            closed = True
+
+        responses: list[bytes] = []
+        for res in results:
+            if not isinstance(res, bool):
+                res = await res
+            responses.append(get_response(res))
+
+        if error:
+            responses.append(error)
+
+        log.debug(f"batch: {len(lines)} requests")
+        writer.writelines(responses)
+        await writer.drain()
+
+    log.info("disconnected")
+    log.debug(f"cache: {primes.cache}")
     writer.close()
 
 
 async def main() -> None:
-    server = await asyncio.start_server(prime, address, port)
+    global pool
+    handler = prime_batched if mode == "batch" else prime
+    server = await asyncio.start_server(handler, address, port)
 
     addr = ", ".join(str(sock.getsockname()) for sock in server.sockets)
-    print(f"Serving on {addr}")
+    print(f"Serving on {addr} ({mode})")
+
+    # workers are started on demand, forking them from the server would
+    # leak client sockets into them.
+    ctx = multiprocessing.get_context("forkserver")
+
+    # stop on SIGTERM as well, so that the pool is shut down and its workers
+    # don't outlive the server.
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
 
-    async with server:
-        await server.serve_forever()
+    with ProcessPoolExecutor(max_workers=pool_workers, mp_context=ctx) as pool:
+        async with server:
+            await stop.wait()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import json
+import re
+
+# 01. Prime Time - request/response codec
+
+# the common request shape with an int that is cheap to convert, anything
+# else goes through json.loads.
+fast_request_re = re.compile(rb'[ \t\r\n]*\{[ \t\r\n]*"method"[ \t\r\n]*:'
+                             rb'[ \t\r\n]*"isPrime"[ \t\r\n]*,[ \t\r\n]*'
+                             rb'"number"[ \t\r\n]*:[ \t\r\n]*'
+                             rb'(-?(?:0|[1-9][0-9]{0,17}))[ \t\r\n]*\}'
+                             rb'[ \t\r\n]*')
+
+PRIME = b'{"method":"isPrime","prime":true}\n'
+NOT_PRIME = b'{"method":"isPrime","prime":false}\n'
+ERROR_PREFIX = b'{"method":"error","error":'
+ERROR_SUFFIX = b'}\n'
+
+
+class InvalidRequestError(ValueError):
+    pass
+
+
+def parse_int(value: str) -> int:
+    # integers longer than the interpreter's conversion limit are rejected
+    # rather than crashing the connection.
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidRequestError(f"number is too large: {len(value)} digits")
+
+
+def parse_message(line: bytes) -> int | float:
+    match = fast_request_re.fullmatch(line)
+    if match:
+        return int(match[1])
+
+    return parse_json(line)
+
+
+def parse_json(line: bytes) -> int | float:
+    try:
+        req = json.loads(line, parse_int=parse_int)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise InvalidRequestError(f"invalid json: {line!r}")
+
+    try:
+        method = req["method"]
+        num = req["number"]
+    except (KeyError, TypeError) as e:
+        raise InvalidRequestError(f"Missing field: {e}")
+
+    if method != "isPrime":
+        raise InvalidRequestError(f"invalid method: {method}")
+
+    if type(num) is not int and type(num) is not float:
+        raise InvalidRequestError("number field must be a number")
+
+    return num
+
+
+def get_response(is_prime: bool) -> bytes:
+    return PRIME if is_prime else NOT_PRIME
+
+
+def get_error(err: str) -> bytes:
+    return b"".join((ERROR_PREFIX, json.dumps(err).encode(), ERROR_SUFFIX))
@@ -1,8 +1,16 @@
 import asyncio
 import logging
+import mmap
 import os
 import struct
 import sys
+import tempfile
+
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Sequence
+
+Bisect = Callable[[Sequence[int], int, int, int], int]
 
 # 02. Means to an End - https://protohackers.com/problem/2
 
@@ -16,57 +24,288 @@ port = int(os.getenv("TCP_PORT", "8080"))
 TYPE_INSERT = b'I'
 TYPE_QUERY = b'Q'
 
-PriceRecord = tuple[int, int]
+# 9 byte messages: type, timestamp/mintime, price/maxtime
+message = struct.Struct(">cii")
+mean_struct = struct.Struct(">i")
+read_size = 65536
+# sessions with more records keep them in a memory-mapped temp file.
+spill_records = int(os.getenv("SPILL_RECORDS", "1048576"))
+spill_dir = os.getenv("SPILL_DIR")
+
+
+class Block:
+    """up to capacity records sorted by timestamp, in two int32 columns"""
+
+    capacity = 1024
+    # bytes of a block buffer: the timestamp column then the price column
+    size = capacity * 2 * 4
+
+    def __init__(self, buf: memoryview) -> None:
+        self.len = 0
+        self.sum = 0
+        self.attach(buf)
+
+    def attach(self, buf: memoryview) -> None:
+        # buf is an int32 view of size bytes, either an array('i') on the
+        # heap or a slot in a spill file.
+        self.buf = buf
+        self.times = buf[:Block.capacity]
+        self.prices = buf[Block.capacity:]
+
+    def move_to(self, buf: memoryview) -> None:
+        buf[:] = self.buf
+        self.release()
+        self.attach(buf)
+
+    def release(self) -> None:
+        self.times.release()
+        self.prices.release()
+        self.buf.release()
+
+    def last(self) -> int:
+        return self.times[self.len - 1]
+
+    def bisect(self, time: int, bisect: Bisect) -> int:
+        return bisect(self.times, time, 0, self.len)
+
+    def insert(self, i: int, time: int, price: int) -> None:
+        n = self.len
+        if i < n:
+            self.times[i + 1:n + 1] = self.times[i:n]
+            self.prices[i + 1:n + 1] = self.prices[i:n]
+
+        self.times[i] = time
+        self.prices[i] = price
+        self.len += 1
+        self.sum += price
+
+    def prefix_sum(self, i: int) -> int:
+        # sum of the first i prices, summing the shorter side
+        if i < self.len // 2:
+            return sum(self.prices[:i])
+        return self.sum - sum(self.prices[i:self.len])
+
+    def split_to(self, other: 'Block') -> None:
+        # move the upper half of the records to the empty other block
+        half, n = self.len // 2, self.len
+        other.times[:n - half] = self.times[half:n]
+        other.prices[:n - half] = self.prices[half:n]
+        other.len = n - half
+        other.sum = sum(other.prices[:other.len])
+        self.len = half
+        self.sum -= other.sum
+
+
+class SpillFile:
+    """block buffers in a memory-mapped temporary file"""
+
+    # slots per mapping, 2MiB with the default block capacity
+    segment_slots = 256
+
+    def __init__(self) -> None:
+        self.file = tempfile.TemporaryFile(dir=spill_dir)
+        self.segments: list[mmap.mmap] = []
+        self.used = 0
+
+    def alloc(self) -> memoryview:
+        segment_size = Block.size * SpillFile.segment_slots
+        seg, slot = divmod(self.used, SpillFile.segment_slots)
+
+        if seg == len(self.segments):
+            # the file grows a segment at a time, mapped segments are never
+            # resized as the blocks keep views into them.
+            self.file.truncate((seg + 1) * segment_size)
+            self.segments.append(
+                mmap.mmap(self.file.fileno(),
+                          segment_size,
+                          offset=seg * segment_size))
+
+        self.used += 1
+        offset = slot * Block.size
+        with memoryview(self.segments[seg]) as view:
+            return view[offset:offset + Block.size].cast("i")
+
+    def close(self) -> None:
+        # all the block views must have been released.
+        for segment in self.segments:
+            segment.close()
+        self.file.close()
+
+
+class PriceIndex:
+    """prices sorted by timestamp in blocks, with prefix sums over blocks"""
+
+    def __init__(self, spill_records: int = spill_records) -> None:
+        self.blocks: list[Block] = []
+        # last timestamp of every block
+        self.maxes: list[int] = []
+        # Fenwick trees over the block sums and block lengths
+        self.tree_sums: list[int] = [0]
+        self.tree_counts: list[int] = [0]
+        self.count = 0
+        # the blocks move to a spill file above this number of records
+        self.spill_records = spill_records
+        self.spill: SpillFile | None = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def insert(self, time: int, price: int) -> None:
+        if not self.blocks:
+            self.blocks.append(Block(self.alloc()))
+            self.maxes.append(time)
+            self.rebuild()
+
+        b = min(bisect_right(self.maxes, time), len(self.maxes) - 1)
+        block = self.blocks[b]
+
+        block.insert(block.bisect(time, bisect_right), time, price)
+        self.maxes[b] = block.last()
+        self.count += 1
+
+        if block.len == Block.capacity:
+            self.split(b)
+        else:
+            self.update(b, price)
+
+        if self.spill is None and self.count >= self.spill_records:
+            self.spill_blocks()
+
+    def query(self, mintime: int, maxtime: int) -> tuple[int, int]:
+        """sum and count of the prices in [mintime, maxtime]"""
+        if mintime > maxtime:
+            return 0, 0
+
+        hi_sum, hi_count = self.rank(maxtime, bisect_right)
+        lo_sum, lo_count = self.rank(mintime, bisect_left)
+        return hi_sum - lo_sum, hi_count - lo_count
+
+    def rank(self, time: int, bisect: Bisect) -> tuple[int, int]:
+        # sum and count of the prices before time (bisect_left) or up to
+        # and including it (bisect_right).
+        b = bisect(self.maxes, time, 0, len(self.maxes))
+        total, count = self.prefix(b)
+
+        if b < len(self.blocks):
+            block = self.blocks[b]
+            i = block.bisect(time, bisect)
+            total += block.prefix_sum(i)
+            count += i
+
+        return total, count
+
+    def memory(self) -> tuple[int, int]:
+        """bytes of record storage on the heap and in the spill file"""
+        size = len(self.blocks) * Block.size
+        return (0, size) if self.spill else (size, 0)
+
+    def close(self) -> None:
+        for block in self.blocks:
+            block.release()
+        self.blocks = []
+
+        if self.spill:
+            self.spill.close()
+
+    def alloc(self) -> memoryview:
+        if self.spill:
+            return self.spill.alloc()
+        return memoryview(array("i", bytes(Block.size)))
+
+    def spill_blocks(self) -> None:
+        self.spill = SpillFile()
+        for block in self.blocks:
+            block.move_to(self.spill.alloc())
+
+    def split(self, b: int) -> None:
+        block, other = self.blocks[b], Block(self.alloc())
+        block.split_to(other)
+
+        self.blocks.insert(b + 1, other)
+        self.maxes[b:b + 1] = [block.last(), other.last()]
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        n = len(self.blocks)
+        self.tree_sums = [0, *(block.sum for block in self.blocks)]
+        self.tree_counts = [0, *(block.len for block in self.blocks)]
+
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self.tree_sums[j] += self.tree_sums[i]
+                self.tree_counts[j] += self.tree_counts[i]
+
+    def update(self, b: int, price: int) -> None:
+        i = b + 1
+        while i < len(self.tree_sums):
+            self.tree_sums[i] += price
+            self.tree_counts[i] += 1
+            i += i & -i
+
+    def prefix(self, b: int) -> tuple[int, int]:
+        # sum and count of the first b blocks
+        total, count = 0, 0
+        while b > 0:
+            total += self.tree_sums[b]
+            count += self.tree_counts[b]
+            b -= b & -b
+        return total, count
 
 
 class Price():
 
     def __init__(self, peer: str, logger: logging.Logger) -> None:
-        self.price_records: list[PriceRecord] = []
+        self.index = PriceIndex()
         self.log = logger
-        self.need = 9
 
     async def handle(self, reader: asyncio.StreamReader,
                      writer: asyncio.StreamWriter) -> None:
-        chunks: list[bytes] = []
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        buf = bytearray()
 
         while not reader.at_eof():
-            buf = await reader.read(self.need)
-            if not buf:
+            chunk = await reader.read(read_size)
+            if not chunk:
                 break  # eof
 
-            chunks.append(buf)
+            # decode every complete message, the partial tail stays in the
+            # buffer until the next read.
+            buf += chunk
+            end = len(buf) - len(buf) % message.size
+            responses: list[bytes] = []
 
-            if len(buf) < self.need:
-                self.need -= len(buf)
-                continue
+            frames = message.iter_unpack(memoryview(buf)[:end])
+            for msg_type, time, data in frames:
+                if debug:
+                    self.log.debug(f"message: [{msg_type}, {time}, {data}]")
 
-            msg_type, time, data = struct.unpack(">cii", b"".join(chunks))
-            self.log.debug(f"message: [{msg_type}, {time}, {data}]")
+                if msg_type == TYPE_INSERT:
+                    self.index.insert(time, data)
 
-            self.need, chunks = 9, []
+                elif msg_type == TYPE_QUERY:
+                    mean = self.mean(*self.index.query(time, data))
+                    if debug:
+                        self.log.debug(f"mean: {mean}")
+                    responses.append(mean_struct.pack(mean))
 
-            if msg_type == TYPE_INSERT:
-                self.price_records.append((time, data))
+                else:
+                    writer.write(b"".join(responses))
+                    raise ValueError(
+                        f"Invalid message type: {msg_type.decode()}")
 
-            elif msg_type == TYPE_QUERY:
-                prices = [
-                    pr for (tm, pr) in self.price_records
-                    if tm >= time and tm <= data
-                ]
-                mean = self.mean(prices)
-                self.log.debug(f"mean: {mean}")
-                writer.write(struct.pack(">i", self.mean(prices)))
-                await writer.drain()
+            del frames  # release the buffer before resizing it
+            del buf[:end]
 
-            else:
-                raise ValueError(f"Invalid message type: {msg_type.decode()}")
+            if responses:
+                writer.write(b"".join(responses))
+                await writer.drain()
 
-    def mean(self, data: list[int]) -> int:
-        if len(data) == 0:
+    def mean(self, total: int, count: int) -> int:
+        if count == 0:
             return 0
 
-        return int(sum(data) / len(data))
+        return int(total / count)
 
 
 async def handler(reader: asyncio.StreamReader,
@@ -74,15 +313,19 @@ async def handler(reader: asyncio.StreamReader,
     peer = ":".join(str(tok) for tok in writer.get_extra_info("peername"))
     log = logging.getLogger(peer)
 
+    price = Price(peer, log)
     log.info("connected")
     try:
-        await Price(peer, log).handle(reader, writer)
+        await price.handle(reader, writer)
 
     except Exception as e:
         log.error(f"error: {e}")
 
     finally:
-        log.info("disconnected")
+        heap, mapped = price.index.memory()
+        log.info(f"disconnected [records: {len(price.index)}, "
+                 f"heap: {heap}, mapped: {mapped}]")
+        price.index.close()
         writer.close()
 
 
@@ -1,8 +1,13 @@
 import asyncio
 import logging
+import multiprocessing
 import os
 import re
+import signal
+import socket
+import struct
 import sys
+import tempfile
 
 # 03. Budget Chat - https://protohackers.com/problem/3
 
@@ -13,13 +18,242 @@ logging.basicConfig(
 address = os.getenv("SOCKET_ADDRESS", "0.0.0.0")
 port = int(os.getenv("TCP_PORT", "8080"))
 
-chat: dict[str, asyncio.StreamWriter] = {}
+# outbound messages queued per member
+queue_size = int(os.getenv("CHAT_QUEUE_SIZE", "1024"))
+# what happens to a member whose queue is full: "drop" the message or
+# "disconnect" the member.
+overflow_policy = os.getenv("CHAT_OVERFLOW", "disconnect")
+# TCP_NODELAY on member sockets (asyncio's default) and TCP_CORK around
+# every coalesced write (Linux only).
+tcp_nodelay = os.getenv("CHAT_NODELAY", "1") == "1"
+tcp_cork = os.getenv("CHAT_CORK", "0") == "1" and hasattr(socket, "TCP_CORK")
+
+# worker processes sharing the port with SO_REUSEPORT, linked by a message
+# bus on a unix socket (CHAT_BUS, a temporary path by default).
+workers = int(os.getenv("CHAT_WORKERS", "1"))
+bus_path = os.getenv("CHAT_BUS")
+
+# members connected to this process
+chat: dict[str, 'Client'] = {}
+
+# bus frames: kind, name length, payload length, name, payload
+frame_header = struct.Struct(">cHI")
+FRAME_JOIN = b"J"  # worker -> hub: claim a name
+FRAME_LEAVE = b"L"  # worker -> hub: release a name
+FRAME_MESSAGE = b"M"  # worker -> hub: message from a member
+FRAME_JOINED = b"O"  # hub -> worker: name claimed, payload is the roster
+FRAME_DUPLICATE = b"D"  # hub -> worker: name is taken
+FRAME_DELIVER = b"B"  # hub -> worker: payload for all members but name
+
+
+def write_frame(writer: asyncio.StreamWriter,
+                kind: bytes,
+                name: bytes,
+                payload: bytes = b"") -> None:
+    writer.writelines(
+        [frame_header.pack(kind, len(name), len(payload)), name, payload])
+
+
+async def read_frame(
+        reader: asyncio.StreamReader) -> tuple[bytes, bytes, bytes]:
+    header = await reader.readexactly(frame_header.size)
+    kind, name_len, payload_len = frame_header.unpack(header)
+    name = await reader.readexactly(name_len)
+    payload = await reader.readexactly(payload_len)
+    return kind, name, payload
+
+
+def roster(names: list[str]) -> bytes:
+    return f"* room contains: {', '.join(names)}\n".encode()
+
+
+def entered(name: str) -> bytes:
+    return f"* {name} has entered the room\n".encode()
+
+
+def left(name: str) -> bytes:
+    return f"* {name} has left the room\n".encode()
+
+
+class LocalRoom():
+    """membership of a single process"""
+
+    async def join(self, client: 'Client') -> None:
+        if client.name in chat:
+            raise ValueError(f"duplicate name: {client.name}")
+
+        client.send(roster(list(chat)))
+        self.deliver(client.name, entered(client.name))
+        chat[client.name] = client
+
+    async def publish(self, client: 'Client', msg: bytes) -> None:
+        self.deliver(client.name, msg)
+
+    def leave(self, client: 'Client') -> None:
+        if chat.get(client.name) is client:
+            del chat[client.name]
+            self.deliver(client.name, left(client.name))
+
+    def deliver(self, sender: str, msg: bytes) -> None:
+        for name, client in chat.items():
+            if sender != name:
+                client.send(msg)
+
+
+class BusRoom(LocalRoom):
+    """membership of all workers, ordered by the hub"""
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.pending: dict[str, tuple['Client', asyncio.Future[None]]] = {}
+
+    async def join(self, client: 'Client') -> None:
+        if client.name in chat or client.name in self.pending:
+            raise ValueError(f"duplicate name: {client.name}")
+
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[client.name] = (client, fut)
+        write_frame(self.writer, FRAME_JOIN, client.name.encode())
+        try:
+            await fut
+
+        finally:
+            # a member that goes away while joining is not added later.
+            if self.pending.get(client.name, (None, None))[0] is client:
+                del self.pending[client.name]
+
+    async def publish(self, client: 'Client', msg: bytes) -> None:
+        # a slow bus (hub) slows the members of this worker down instead of
+        # buffering their messages without limit.
+        write_frame(self.writer, FRAME_MESSAGE, client.name.encode(), msg)
+        await self.writer.drain()
+
+    def leave(self, client: 'Client') -> None:
+        if chat.get(client.name) is client:
+            del chat[client.name]
+            write_frame(self.writer, FRAME_LEAVE, client.name.encode())
+
+    async def run(self) -> None:
+        while True:
+            kind, bname, payload = await read_frame(self.reader)
+            name = bname.decode()
+
+            if kind == FRAME_DELIVER:
+                self.deliver(name, payload)
+
+            elif kind == FRAME_JOINED:
+                if name not in self.pending:
+                    # the member left while joining, release the name.
+                    write_frame(self.writer, FRAME_LEAVE, bname)
+                    continue
+
+                # the member is added before any later frame is processed,
+                # so it gets every broadcast after the roster.
+                client, fut = self.pending.pop(name)
+                client.send(payload)
+                chat[name] = client
+                fut.set_result(None)
+
+            elif kind == FRAME_DUPLICATE and name in self.pending:
+                _, fut = self.pending.pop(name)
+                fut.set_exception(ValueError(f"duplicate name: {name}"))
+
+
+class Hub():
+    """orders joins, leaves and messages of all the workers"""
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.log = logger
+        self.members: dict[bytes, asyncio.StreamWriter] = {}
+        self.workers: set[asyncio.StreamWriter] = set()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        self.workers.add(writer)
+        self.log.info(f"worker connected [workers: {len(self.workers)}]")
+
+        try:
+            while True:
+                kind, name, payload = await read_frame(reader)
+
+                if kind == FRAME_MESSAGE:
+                    self.broadcast(name, payload)
+
+                elif kind == FRAME_JOIN:
+                    self.join(writer, name)
+
+                elif kind == FRAME_LEAVE:
+                    self.leave(name)
+
+                await self.drain()
+
+        except asyncio.IncompleteReadError:
+            pass
+
+        finally:
+            self.workers.discard(writer)
+            self.log.info(
+                f"worker disconnected [workers: {len(self.workers)}]")
+            for name, owner in list(self.members.items()):
+                if owner is writer:
+                    self.leave(name)
+            writer.close()
+
+    def join(self, writer: asyncio.StreamWriter, name: bytes) -> None:
+        if name in self.members:
+            write_frame(writer, FRAME_DUPLICATE, name)
+            return
+
+        names = [member.decode() for member in self.members]
+        write_frame(writer, FRAME_JOINED, name, roster(names))
+        self.members[name] = writer
+        self.broadcast(name, entered(name.decode()))
+
+    def leave(self, name: bytes) -> None:
+        if self.members.pop(name, None):
+            self.broadcast(name, left(name.decode()))
+
+    def broadcast(self, name: bytes, payload: bytes) -> None:
+        for writer in self.workers:
+            write_frame(writer, FRAME_DELIVER, name, payload)
+
+    async def drain(self) -> None:
+        # a slow worker stops the hub from reading further frames rather
+        # than buffering them without limit.
+        for writer in list(self.workers):
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass  # cleaned up by the handler of the worker
+
+
+room = LocalRoom()
 
 
 class Client():
 
+    def __init__(self, logger: logging.Logger) -> None:
+        self.log = logger
+        self.name = ""
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(queue_size)
+        self.sender: asyncio.Task[None] | None = None
+        self.closing = False
+        # queue counters
+        self.max_depth = 0
+        self.dropped = 0
+        self.sent = 0
+        self.writes = 0
+
     async def handle(self, reader: asyncio.StreamReader,
                      writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.sock = writer.get_extra_info("socket")
+        if self.sock is not None:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                 tcp_nodelay)
+
         writer.write(b"Welcome to budgetchat! What shall I call you?\n")
         await writer.drain()
 
@@ -27,43 +261,73 @@ class Client():
         self.name = name.decode().strip()
         self.validate_name()
 
-        await self.register(writer)
+        self.sender = asyncio.create_task(self.send_loop())
+        await room.join(self)
+        prefix = f"[{self.name}] ".encode()
 
         while not reader.at_eof():
             line = await reader.readline()
             if not line:
                 break  # eof
 
-            await self.broadcast(b" ".join([f"[{self.name}]".encode(), line]))
+            # one immutable buffer is queued to every member.
+            await room.publish(self, prefix + line)
 
     def validate_name(self) -> None:
-        if self.name in chat:
-            raise ValueError("duplicate name: {self.name}")
-
         if len(self.name) == 0 or not re.match("^[a-zA-Z0-9]*$", self.name):
             raise ValueError(f"invalid name: {self.name}")
 
-    async def register(self, writer: asyncio.StreamWriter) -> None:
-        names = ", ".join([name for name in chat])
-        writer.write(f"* room contains: {names}\n".encode())
-        await writer.drain()
+    def send(self, msg: bytes) -> None:
+        if self.closing:
+            return
 
-        await self.broadcast(f"* {self.name} has entered the room\n".encode())
-        chat[self.name] = writer
+        try:
+            self.queue.put_nowait(msg)
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+        except asyncio.QueueFull:
+            if overflow_policy == "drop":
+                self.dropped += 1
+                return
 
-    async def broadcast(self, msg: bytes) -> None:
-        for name, sock in chat.items():
-            if self.name != name:
-                sock.write(msg)
-                await sock.drain()
+            # the read loop sees the aborted connection and unregisters.
+            self.log.error(f"slow consumer, disconnecting: {self.stats()}")
+            self.close()
+            self.writer.transport.abort()
 
-    async def unregister(self) -> None:
+    async def send_loop(self) -> None:
         try:
-            del chat[self.name]
-            await self.broadcast(f"* {self.name} has left the room\n".encode())
+            while True:
+                # everything queued since the last write (usually all the
+                # messages of a loop iteration) goes out in one write.
+                batch = [await self.queue.get()]
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
 
-        except KeyError:
-            return
+                self.cork(True)
+                self.writer.writelines(batch)
+                await self.writer.drain()
+                self.cork(False)
+
+                self.sent += len(batch)
+                self.writes += 1
+
+        except ConnectionError as e:
+            self.log.debug(f"send error: {e}")
+
+    def cork(self, on: bool) -> None:
+        if tcp_cork and self.sock is not None:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, on)
+
+    def close(self) -> None:
+        self.closing = True
+        if self.sender:
+            self.sender.cancel()
+
+    def stats(self) -> str:
+        return (f"queue depth: {self.queue.qsize()}, "
+                f"max depth: {self.max_depth}, dropped: {self.dropped}, "
+                f"sent: {self.sent}, writes: {self.writes}")
 
 
 async def handler(reader: asyncio.StreamReader,
@@ -71,7 +335,7 @@ async def handler(reader: asyncio.StreamReader,
     peer = ":".join(str(tok) for tok in writer.get_extra_info("peername"))
     log = logging.getLogger(peer)
 
-    client = Client()
+    client = Client(log)
     log.info("connected")
 
     try:
@@ -81,12 +345,83 @@ async def handler(reader: asyncio.StreamReader,
         log.error(f"error: {e}")
 
     finally:
-        log.info("disconnected")
-        await client.unregister()
+        log.info(f"disconnected [{client.stats()}]")
+        room.leave(client)
+        client.close()
         writer.close()
 
 
+async def serve_worker(path: str) -> None:
+    global room
+    log = logging.getLogger(f"worker-{os.getpid()}")
+
+    reader, writer = await asyncio.open_unix_connection(path)
+    bus = BusRoom(reader, writer)
+    room = bus
+
+    server = await asyncio.start_server(handler,
+                                        address,
+                                        port,
+                                        reuse_port=True)
+    log.info(f"Serving on {address}:{port}")
+
+    async with server:
+        await asyncio.gather(server.serve_forever(), bus.run())
+
+
+def run_worker(path: str) -> None:
+    try:
+        asyncio.run(serve_worker(path))
+    except (KeyboardInterrupt, asyncio.IncompleteReadError, ConnectionError):
+        pass  # interrupted or the hub has gone away
+
+
+async def serve_hub() -> None:
+    log = logging.getLogger("hub")
+    tmp = None
+    path = bus_path
+    if not path:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "chat.sock")
+    hub = Hub(log)
+    server = await asyncio.start_unix_server(hub.handle, path)
+
+    ctx = multiprocessing.get_context("forkserver")
+    procs = [
+        ctx.Process(target=run_worker, args=(path, ), daemon=True)
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+
+    print(f"Serving on {address}:{port} with {workers} workers, bus: {path}")
+
+    # stop on SIGTERM as well, so that the workers and the bus are cleaned
+    # up.
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+
+    try:
+        async with server:
+            await stop.wait()
+
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+        # let the hub see the workers go.
+        while hub.workers:
+            await asyncio.sleep(0.01)
+        os.unlink(path)
+        if tmp:
+            os.rmdir(tmp)
+
+
 async def main() -> None:
+    if workers > 1:
+        return await serve_hub()
+
     server = await asyncio.start_server(handler, address, port)
 
     addr = ", ".join(str(sock.getsockname()) for sock in server.sockets)
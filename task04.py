@@ -1,7 +1,20 @@
 import asyncio
+import io
 import logging
+import mmap
+import multiprocessing
 import os
+import random
+import socket
+import struct
 import sys
+import zlib
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.synchronize import Lock
+from typing import cast
 
 # 04. Unusual database - https://protohackers.com/problem/4
 
@@ -11,54 +24,491 @@ logging.basicConfig(
 
 address = os.getenv("SOCKET_ADDRESS", "0.0.0.0")
 port = int(os.getenv("UDP_PORT", "5000"))
+# directory of the insert log and snapshots, persistence is off if unset.
+db_path = os.getenv("DB_PATH")
+# seconds between group commits (write + fsync) of the log
+fsync_interval = float(os.getenv("DB_FSYNC_INTERVAL", "0.05"))
+# the log is compacted into a snapshot after this many records
+snapshot_records = int(os.getenv("DB_SNAPSHOT_RECORDS", "100000"))
+# receive engine: "protocol" (DatagramProtocol, one callback per datagram) or
+# "batch" (non-blocking recvfrom loop per wakeup).
+mode = os.getenv("DB_MODE", "protocol")
+# max datagrams handled per wakeup in batch mode
+recv_batch = int(os.getenv("DB_RECV_BATCH", "256"))
+max_datagram = 65536
+# budget of the stored key and value bytes, unbounded if 0
+max_bytes = int(os.getenv("DB_MAX_BYTES", "0"))
+# eviction policy once over the budget: "lru" or "lfu" (approximate)
+eviction = os.getenv("DB_EVICTION", "lru")
+# seconds between store stats log messages, off if 0
+stats_interval = float(os.getenv("DB_STATS_INTERVAL", "60"))
+# worker processes sharing the port (SO_REUSEPORT) and a shared memory table
+workers = int(os.getenv("DB_WORKERS", "1"))
+# slots of the shared memory table (rounded up to a power of two)
+table_slots = int(os.getenv("DB_TABLE_SLOTS", "65536"))
+lock_stripes = 64
 
 Address = tuple[str, int]
 
+# log and snapshot records: key length, value length, key, value
+record = struct.Struct(">HH")
+# snapshot header: magic, first log generation not in the snapshot
+snapshot_header = struct.Struct(">4sQ")
+SNAPSHOT_MAGIC = b"UDB1"
+# keys that clients cannot insert
+protected_keys = frozenset([b"version"])
 
-class UnusualDB(asyncio.DatagramProtocol):
-    version = 'Odd database v1.0'
 
-    def __init__(self, logger: logging.Logger) -> None:
-        self.log = logger
-        self.store: dict[str, str] = {}
+class LRU:
+    """evicts the least recently used key"""
 
-    # transport should be asyncio.DatagramTransport, but that causes mypy
-    # type error in self.send.
-    def connection_made(self, transport: asyncio.BaseTransport) -> None:
-        self.transport = transport
+    def __init__(self) -> None:
+        self.keys: OrderedDict[bytes, None] = OrderedDict()
+
+    def insert(self, key: bytes) -> None:
+        self.keys[key] = None
+
+    def touch(self, key: bytes) -> None:
+        self.keys.move_to_end(key)
+
+    def remove(self, key: bytes) -> None:
+        del self.keys[key]
+
+    def victim(self) -> bytes:
+        return next(iter(self.keys))
+
+
+class LFU:
+    """evicts the least frequently used of a few sampled keys
+
+    Access counts are 8 bit logarithmic counters (as in redis), so that
+    popular keys saturate slowly and new keys start above the minimum.
+    """
+
+    samples = 5
+    initial = 5
+    log_factor = 10
+
+    def __init__(self) -> None:
+        # keys in a list for O(1) random sampling and swap-removal
+        self.keys: list[bytes] = []
+        self.pos: dict[bytes, int] = {}
+        self.counts: dict[bytes, int] = {}
+
+    def insert(self, key: bytes) -> None:
+        self.pos[key] = len(self.keys)
+        self.keys.append(key)
+        self.counts[key] = self.initial
+
+    def touch(self, key: bytes) -> None:
+        count = self.counts[key]
+        if count < 255:
+            base = max(0, count - self.initial)
+            if random.random() * (base * self.log_factor + 1) < 1:
+                self.counts[key] = count + 1
+
+    def remove(self, key: bytes) -> None:
+        idx = self.pos.pop(key)
+        last = self.keys.pop()
+        if last != key:
+            self.keys[idx] = last
+            self.pos[last] = idx
+        del self.counts[key]
+
+    def victim(self) -> bytes:
+        sample = (self.keys[random.randrange(len(self.keys))]
+                  for _ in range(min(self.samples, len(self.keys))))
+        return min(sample, key=self.counts.__getitem__)
+
+
+policies = {"lru": LRU, "lfu": LFU}
 
-    def datagram_received(self, data: bytes, addr: Address) -> None:
-        msg = data.decode()
 
-        self.log.debug(f"data: {msg}, addr: {addr}")
+class Store:
+    """key/value store within a budget of key and value bytes"""
 
-        if len(msg) > 1000:
-            self.log.error(f"receive: message is too big: {msg}")
+    def __init__(self,
+                 budget: int = 0,
+                 policy: str = "lru",
+                 protected: frozenset[bytes] = protected_keys) -> None:
+        self.data: dict[bytes, bytes] = {}
+        self.budget = budget
+        # a policy is only needed to evict, so it is skipped if unbounded.
+        self.policy = policies[policy]() if budget else None
+        self.protected = protected
+        self.bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
 
-        key, value, is_insert = self.parse(msg)
+    def __len__(self) -> int:
+        return len(self.data)
 
-        if key == "version":
-            self.send(f"version={UnusualDB.version}", addr)
+    def get(self, key: bytes) -> bytes | None:
+        value = self.data.get(key)
+        if value is not None and self.policy:
+            self.policy.touch(key)
+        return value
+
+    def put(self, key: bytes, value: bytes) -> None:
+        if key in self.protected:
             return
 
-        if is_insert:
-            self.log.debug(f"insert: {key}={value}")
-            self.store[key] = value
+        old = self.data.get(key)
+        self.data[key] = value
 
+        if old is None:
+            self.bytes += len(key) + len(value)
         else:
-            self.log.debug(f"query: {key}={self.store.get(key, '')}")
-            self.send(f"{key}={self.store.get(key, '')}", addr)
+            self.bytes += len(value) - len(old)
+
+        if not self.policy:
+            return
 
-    def send(self, msg: str, addr: Address) -> None:
-        # hack to shut the mypy hack about transport not being
-        # DatagramTransport in connection_made.
-        assert (isinstance(self.transport, asyncio.DatagramTransport))
+        if old is None:
+            self.policy.insert(key)
+        else:
+            self.policy.touch(key)
+
+        while self.bytes > self.budget and self.data:
+            self.evict(self.policy.victim())
+
+    def update(self, items: dict[bytes, bytes]) -> None:
+        for key, value in items.items():
+            self.put(key, value)
+
+    def evict(self, key: bytes) -> None:
+        assert self.policy
+        value = self.data.pop(key)
+        self.policy.remove(key)
+        self.bytes -= len(key) + len(value)
+        self.evictions += 1
+        self.evicted_bytes += len(key) + len(value)
+
+    def __str__(self) -> str:
+        return (f"keys:{len(self.data)} bytes:{self.bytes}/{self.budget} "
+                f"evictions:{self.evictions} "
+                f"evicted_bytes:{self.evicted_bytes}")
+
+
+class SharedTable:
+    """fixed-slot open addressing hash table in shared memory
+
+    Slots are never freed, so a key keeps the slot it was first stored in
+    and a probe only needs the (striped) lock of the slot it looks at.
+    Probes are bounded: a key that finds no free slot within max_probes of
+    its hash is rejected, and lookups stop there too.
+    """
+
+    # used, key length, value length + key and value of a <= 1000 byte
+    # request
+    slot = struct.Struct("=BHH")
+    slot_size = 1024
+    max_probes = 32
+
+    def __init__(self,
+                 slots: int,
+                 locks: list[Lock],
+                 name: str | None = None,
+                 protected: frozenset[bytes] = protected_keys) -> None:
+        self.slots = 1 << (slots - 1).bit_length()
+        self.mask = self.slots - 1
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=self.slots * self.slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        assert self.shm.buf is not None
+        self.buf = self.shm.buf
+        self.probes = min(self.max_probes, self.slots)
+        self.locks = locks
+        self.protected = protected
+        self.inserts = 0
+        self.rejected = 0
+
+    def get(self, key: bytes) -> bytes | None:
+        idx = zlib.crc32(key) & self.mask
+        for _ in range(self.probes):
+            offset = idx * self.slot_size
+            with self.locks[idx % len(self.locks)]:
+                used, key_len, value_len = self.slot.unpack_from(
+                    self.buf, offset)
+                if not used:
+                    return None
+
+                start = offset + self.slot.size
+                if self.holds(start, key_len, key):
+                    start += key_len
+                    return bytes(self.buf[start:start + value_len])
+
+            idx = (idx + 1) & self.mask
+
+        return None
+
+    def put(self, key: bytes, value: bytes) -> None:
+        if key in self.protected:
+            return
 
-        if len(msg) > 1000:
-            self.log.error(f"send: message is too big: {msg}")
+        if len(key) + len(value) > self.slot_size - self.slot.size:
+            self.rejected += 1
             return
 
-        self.transport.sendto(msg.encode(), addr)
+        idx = zlib.crc32(key) & self.mask
+        for _ in range(self.probes):
+            offset = idx * self.slot_size
+            with self.locks[idx % len(self.locks)]:
+                used, key_len, _ = self.slot.unpack_from(self.buf, offset)
+                start = offset + self.slot.size
+
+                if not used:
+                    self.buf[start:start + len(key)] = key
+                    key_len = len(key)
+                elif not self.holds(start, key_len, key):
+                    idx = (idx + 1) & self.mask
+                    continue
+
+                start += key_len
+                self.buf[start:start + len(value)] = value
+                self.slot.pack_into(self.buf, offset, 1, key_len, len(value))
+                self.inserts += 1
+                return
+
+        self.rejected += 1  # no free slot within the probe limit
+
+    def holds(self, start: int, key_len: int, key: bytes) -> bool:
+        # whether the slot key at start is key
+        return (key_len == len(key)
+                and self.buf[start:start + key_len].tobytes() == key)
+
+    def close(self) -> None:
+        del self.buf
+        self.shm.close()
+
+    def __str__(self) -> str:
+        return (f"slots:{self.slots} inserts:{self.inserts} "
+                f"rejected:{self.rejected}")
+
+
+class Journal:
+    """append-only insert log with group commit and compacted snapshots"""
+
+    def __init__(self, path: str, logger: logging.Logger) -> None:
+        self.path = path
+        self.log = logger
+        self.pending: list[bytes] = []
+        self.records = 0  # records in the current log
+        self.generation = 0
+        # all file io runs in order on one thread, off the event loop.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(path, exist_ok=True)
+
+    def log_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"log.{generation:08d}")
+
+    def snapshot_path(self) -> str:
+        return os.path.join(self.path, "snapshot")
+
+    def recover(self) -> dict[bytes, bytes]:
+        store: dict[bytes, bytes] = {}
+
+        try:
+            with open(self.snapshot_path(), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    magic, self.generation = snapshot_header.unpack_from(mm)
+                    if magic != SNAPSHOT_MAGIC:
+                        raise ValueError(f"invalid snapshot: {magic!r}")
+                    self.read_records(mm, snapshot_header.size, store)
+        except FileNotFoundError:
+            pass
+
+        snapshot_generation = self.generation
+        end = 0
+        for name in sorted(os.listdir(self.path)):
+            if not name.startswith("log."):
+                continue
+
+            generation = int(name[4:])
+            if generation < snapshot_generation:
+                continue  # already in the snapshot
+
+            with open(os.path.join(self.path, name), "rb") as f:
+                self.records, end = self.read_records(f.read(), 0, store)
+            self.generation = generation
+
+        self.log.info(f"recovered {len(store)} keys from {self.path}")
+        self.file = open(self.log_path(self.generation), "ab")
+        # drop a torn record so that new ones are appended after the last
+        # valid one.
+        self.file.truncate(end)
+        return store
+
+    def read_records(self, buf: bytes | mmap.mmap, offset: int,
+                     store: dict[bytes, bytes]) -> tuple[int, int]:
+        count = 0
+        while offset + record.size <= len(buf):
+            key_len, value_len = record.unpack_from(buf, offset)
+            start = offset + record.size
+            end = start + key_len + value_len
+            if end > len(buf):
+                break  # torn write at the end of a log
+
+            store[buf[start:start + key_len]] = buf[start + key_len:end]
+            offset = end
+            count += 1
+
+        return count, offset
+
+    def append(self, key: bytes, value: bytes) -> None:
+        # no io here - the record is written by the next group commit.
+        self.pending.append(
+            b"".join([record.pack(len(key), len(value)), key, value]))
+
+    async def run(self, store: dict[bytes, bytes]) -> None:
+        while True:
+            await asyncio.sleep(fsync_interval)
+            await self.commit()
+
+            if self.records >= snapshot_records:
+                await self.snapshot(store)
+
+    async def commit(self) -> None:
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        self.records += len(batch)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.write, self.file,
+                                   b"".join(batch))
+
+    def write(self, file: io.BufferedWriter, data: bytes) -> None:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    async def snapshot(self, store: dict[bytes, bytes]) -> None:
+        # inserts from now on go to the next log, the snapshot covers all
+        # the earlier ones.
+        old = self.file
+        self.generation += 1
+        self.records = 0
+        self.file = open(self.log_path(self.generation), "ab")
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.write_snapshot,
+                                   store.copy(), self.generation, old)
+
+    def write_snapshot(self, store: dict[bytes, bytes], generation: int,
+                       old: io.BufferedWriter) -> None:
+        old.close()
+        tmp = f"{self.snapshot_path()}.tmp"
+
+        with open(tmp, "wb") as f:
+            f.write(snapshot_header.pack(SNAPSHOT_MAGIC, generation))
+            for key, value in store.items():
+                f.write(record.pack(len(key), len(value)))
+                f.write(key)
+                f.write(value)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, self.snapshot_path())
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        for gen in range(generation - 1, -1, -1):
+            try:
+                os.remove(self.log_path(gen))
+            except FileNotFoundError:
+                break
+
+        self.log.info(f"snapshot: {len(store)} keys, generation {generation}")
+
+    def close(self) -> None:
+        # wait for a commit or snapshot in flight before the final commit.
+        self.executor.shutdown()
+        if self.pending:
+            self.write(self.file, b"".join(self.pending))
+            self.pending = []
+        self.file.close()
+
+
+class UnusualDB(asyncio.DatagramProtocol):
+    version = 'Odd database v1.0'
+    version_reply = f"version={version}".encode()
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 store: Store | SharedTable | None = None,
+                 journal: Journal | None = None) -> None:
+        self.log = logger
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+        self.store = store if store is not None else Store()
+        self.journal = journal
+        self.buf = bytearray(max_datagram)
+        self.view = memoryview(self.buf)
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        reply = self.handle(data, addr)
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+
+    def read_ready(self, sock: socket.socket) -> None:
+        # batch mode: drain up to recv_batch datagrams per wakeup from the
+        # non-blocking socket instead of one callback per datagram.
+        for _ in range(recv_batch):
+            try:
+                nbytes, addr = sock.recvfrom_into(self.buf)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                self.log.error(f"receive: {e}")
+                return
+
+            reply = self.handle(bytes(self.view[:nbytes]), addr)
+            if reply is not None:
+                try:
+                    sock.sendto(reply, addr)
+                except OSError as e:
+                    # udp is lossy anyway, never block on a full buffer.
+                    self.log.error(f"send: {e}")
+
+    def handle(self, data: bytes, addr: Address) -> bytes | None:
+        if self.debug:
+            self.log.debug(f"data: {data!r}, addr: {addr}")
+
+        if len(data) > 1000:
+            self.log.error(f"receive: message is too big: {data!r}")
+
+        hi = data.find(b"=")
+        key = data if hi < 0 else data[:hi]
+
+        if key == b"version":
+            return self.version_reply
+
+        if hi >= 0:
+            value = data[hi + 1:]
+            if self.debug:
+                self.log.debug(f"insert: {key!r}={value!r}")
+            self.store.put(key, value)
+            if self.journal:
+                self.journal.append(key, value)
+            return None
+
+        reply = b"".join((key, b"=", self.store.get(key) or b""))
+        if self.debug:
+            self.log.debug(f"query: {reply!r}")
+
+        if len(reply) > 1000:
+            self.log.error(f"send: message is too big: {reply!r}")
+            return None
+
+        return reply
 
     def error_received(self, exc: Exception) -> None:
         self.log.error(f"connection lost: {exc}")
@@ -66,28 +516,47 @@ class UnusualDB(asyncio.DatagramProtocol):
     def connection_lost(self, exc: Exception | None) -> None:
         self.log.debug(f"connection lost: {exc}")
 
-    def parse(self, msg: str) -> tuple[str, str, bool]:
-        try:
-            hi = msg.index("=")
-            insert = True
-
-        except ValueError:
-            hi = len(msg)
-            insert = False
-
-        return msg[:hi], msg[hi + 1:], insert
 
+async def log_stats(log: logging.Logger, store: Store | SharedTable) -> None:
+    while True:
+        await asyncio.sleep(stats_interval)
+        log.info(f"store: {store}")
 
-async def main() -> None:
-    log = logging.getLogger("unusualdb")
-    log.info(f"Listening on {address}:{port}")
 
+async def serve(log: logging.Logger,
+                store: Store | SharedTable,
+                journal: Journal | None = None,
+                reuse_port: bool = False) -> None:
     loop = asyncio.get_running_loop()
     exit_future: asyncio.Future[bool] = loop.create_future()
 
-    # One protocol instance will be created to serve all client requests.
-    transport, protocol = await loop.create_datagram_endpoint(
-        lambda: UnusualDB(log), local_addr=(address, port))
+    # one protocol instance serves all client requests in either mode.
+    protocol = UnusualDB(log, store, journal)
+    sock: socket.socket | None = None
+    transport: asyncio.DatagramTransport | None = None
+
+    if mode == "batch":
+        # the family follows the address, as in create_datagram_endpoint.
+        family, kind, proto, _, addr = socket.getaddrinfo(
+            address, port, type=socket.SOCK_DGRAM)[0]
+        sock = socket.socket(family, kind, proto)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(addr)
+        sock.setblocking(False)
+        loop.add_reader(sock.fileno(), protocol.read_ready, sock)
+    else:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: protocol,
+            local_addr=(address, port),
+            reuse_port=reuse_port)
+
+    committer = None
+    if journal:
+        assert isinstance(store, Store)
+        committer = asyncio.create_task(journal.run(store.data))
+    stats = asyncio.create_task(
+        log_stats(log, store)) if stats_interval > 0 else None
 
     try:
         await exit_future
@@ -96,8 +565,74 @@ async def main() -> None:
         log.info("closing...")
 
     finally:
-        transport.close()
-        del protocol
+        if sock:
+            loop.remove_reader(sock.fileno())
+            sock.close()
+        if transport:
+            transport.close()
+        if committer:
+            committer.cancel()
+        if stats:
+            stats.cancel()
+        log.info(f"store: {store}")
+        if journal:
+            journal.close()
+
+
+def run_worker(name: str, slots: int, locks: list[Lock]) -> None:
+    log = logging.getLogger(f"worker-{os.getpid()}")
+    table = SharedTable(slots, locks, name)
+    try:
+        asyncio.run(serve(log, table, reuse_port=True))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        table.close()
+
+
+async def serve_workers(log: logging.Logger) -> None:
+    if db_path or max_bytes:
+        log.warning("DB_PATH and DB_MAX_BYTES are ignored with workers")
+
+    ctx = multiprocessing.get_context("forkserver")
+    locks = [ctx.Lock() for _ in range(lock_stripes)]
+    table = SharedTable(table_slots, locks)
+    procs = [
+        ctx.Process(target=run_worker,
+                    args=(table.shm.name, table.slots, locks),
+                    daemon=True) for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+
+    log.info(f"{workers} workers, table: {table.shm.name} "
+             f"({table.slots} slots)")
+
+    try:
+        await asyncio.get_running_loop().create_future()
+
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+        table.close()
+        table.shm.unlink()
+
+
+async def main() -> None:
+    log = logging.getLogger("unusualdb")
+    log.info(f"Listening on {address}:{port} ({mode})")
+
+    if workers > 1:
+        return await serve_workers(log)
+
+    journal = Journal(db_path, log) if db_path else None
+    store = Store(max_bytes, eviction)
+    if journal:
+        store.update(journal.recover())
+
+    await serve(log, store, journal)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 import asyncio
+import collections
 import logging
 import os
 import re
 import sys
+import time
 
 # 05. Mob in the Middle - https://protohackers.com/problem/5
 
@@ -16,6 +18,69 @@ port = int(os.getenv("TCP_PORT", "8080"))
 # Proxy backend address and port
 be_address = os.getenv("BE_ADDRESS", "127.0.0.1")
 be_port = int(os.getenv("BE_PORT", "8888"))
+# seconds to wait for a backend connection to be established
+be_connect_timeout = float(os.getenv("BE_CONNECT_TIMEOUT", "5"))
+# backend connections kept established ahead of clients, off if 0
+be_pool_size = int(os.getenv("BE_POOL_SIZE", "0"))
+# seconds an idle pooled connection is kept before it is replaced
+be_pool_max_idle = float(os.getenv("BE_POOL_MAX_IDLE", "60"))
+# read size and maximum buffered line length of the address rewriter
+read_size = 65536
+line_limit = 65536
+
+Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AddressRewriter:
+    """line based address rewriter working on raw chunks
+
+    The current line is buffered until its newline, so that the addresses
+    in it are rewritten and its trailing blanks stripped in one go, as the
+    old readline handler did. Only a line growing past line_limit is passed
+    on as it arrives, holding back just the tail the rest of the line still
+    decides on. An unterminated line at eof is dropped.
+    """
+
+    max_len = 35
+    addr_re = re.compile(rb"(?<![^ \n])7[0-9a-zA-z]{25,34}(?=[ \n])")
+    # trailing blanks end the line like rstrip() did, before the newline.
+    blanks = b" \t\r\x0b\x0c"
+    eol_re = re.compile(rb"[ \t\r\x0b\x0c]+\n")
+
+    def __init__(self, replacement: bytes) -> None:
+        self.replacement = replacement
+        self.line = bytearray()
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        out: list[bytes] = []
+
+        last = chunk.rfind(b"\n") + 1
+        if last:
+            lines = self.line + chunk[:last] if self.line else chunk[:last]
+            lines = self.eol_re.sub(b"\n", lines)
+            out.append(self.addr_re.sub(self.replacement, lines))
+            self.line.clear()
+
+        self.line += chunk[last:]
+        if len(self.line) > line_limit:
+            out.append(self.pass_on())
+        return out
+
+    def pass_on(self) -> bytes:
+        # hold back the last token and the blanks after it, as whether it
+        # is an address depends on what follows. A token longer than an
+        # address is clipped, it cannot become one any more, and so is a
+        # blank run past the cap, keeping one blank for the context.
+        line = self.line
+        end = len(line.rstrip(self.blanks))
+        if len(line) - end > line_limit:
+            lo = len(line) - 1
+        else:
+            lo = max(line.rfind(b" ", 0, end) + 1, end - self.max_len - 1)
+
+        out = self.addr_re.sub(self.replacement, line[:lo])
+        del line[:lo]
+        return out
 
 
 class BogusCoin:
@@ -28,23 +93,18 @@ class BogusCoin:
         self.log = logger
 
     async def handle(self, reader: asyncio.StreamReader,
-                     writer: asyncio.StreamWriter,
-                     close_event: asyncio.Event) -> None:
-        while not close_event.is_set():
-            try:
-                buf = await asyncio.wait_for(reader.readline(), 1)
-            except asyncio.TimeoutError:
-                continue
+                     writer: asyncio.StreamWriter) -> None:
+        rewriter = AddressRewriter(BogusCoin.evil_addr.encode())
+
+        while True:
+            chunk = await reader.read(read_size)
 
-            if not buf or buf[-1] != ord("\n"):
-                close_event.set()
+            if not chunk:
                 return  # eof
 
-            line = buf.rstrip().decode()
-            self.log.debug(f"line: {line}")
+            self.log.debug(f"chunk: {len(chunk)} bytes")
 
-            changed = self.replace_address(line)
-            writer.write(f"{changed}\n".encode())
+            writer.writelines(rewriter.feed(chunk))
             await writer.drain()
 
     def replace_address(self, msg: str) -> str:
@@ -70,6 +130,123 @@ class BogusCoin:
         return "".join(chunks)
 
 
+class BackendProtocol(asyncio.StreamReaderProtocol):
+    """stream protocol that remembers an eof from the backend
+
+    StreamReader.at_eof() stays False while received data is unread, as
+    with a backend that sends its welcome and then closes the connection.
+    """
+
+    eof = False
+
+    def eof_received(self) -> bool | None:
+        self.eof = True
+        return super().eof_received()
+
+
+async def open_backend() -> Connection:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    protocol = BackendProtocol(reader, loop=loop)
+    transport, _ = await loop.create_connection(lambda: protocol, be_address,
+                                                be_port)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+async def connect_backend() -> Connection:
+    return await asyncio.wait_for(open_backend(), be_connect_timeout)
+
+
+class BackendPool:
+    """backend connections established ahead of clients
+
+    A background task keeps the pool filled, so clients only wait for a
+    backend handshake when the pool has run dry.
+    """
+
+    def __init__(self, size: int, logger: logging.Logger) -> None:
+        self.size = size
+        self.log = logger
+        # (reader, writer, time it was established)
+        self.idle: collections.deque[tuple[asyncio.StreamReader,
+                                           asyncio.StreamWriter,
+                                           float]] = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.failures = 0
+
+    async def acquire(self) -> Connection:
+        self.wakeup.set()
+
+        while self.idle:
+            reader, writer, created = self.idle.popleft()
+            if self.healthy(reader, writer, created):
+                self.hits += 1
+                return reader, writer
+
+            self.stale += 1
+            writer.close()
+
+        self.misses += 1
+        return await connect_backend()
+
+    def healthy(self, reader: asyncio.StreamReader,
+                writer: asyncio.StreamWriter, created: float) -> bool:
+        protocol = writer.transport.get_protocol()
+        closed = isinstance(protocol, BackendProtocol) and protocol.eof
+        return not (closed or reader.at_eof()
+                    or reader.exception() is not None or writer.is_closing()
+                    or time.monotonic() - created > be_pool_max_idle)
+
+    async def run(self) -> None:
+        backoff = 0.1
+
+        while True:
+            # drop connections that went stale while idle.
+            while self.idle and not self.healthy(*self.idle[0]):
+                self.stale += 1
+                self.idle.popleft()[1].close()
+
+            if len(self.idle) >= self.size:
+                self.wakeup.clear()
+                # wake up on acquire or when the oldest connection expires.
+                timeout = be_pool_max_idle - (time.monotonic() -
+                                              self.idle[0][2])
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(),
+                                           max(timeout, 0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                reader, writer = await connect_backend()
+
+            except (OSError, asyncio.TimeoutError) as e:
+                self.failures += 1
+                self.log.error(f"backend connect: {e!r}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, be_connect_timeout)
+                continue
+
+            backoff = 0.1
+            self.idle.append((reader, writer, time.monotonic()))
+
+    def close(self) -> None:
+        while self.idle:
+            self.idle.popleft()[1].close()
+
+    def __str__(self) -> str:
+        return (f"idle:{len(self.idle)}/{self.size} hits:{self.hits} "
+                f"misses:{self.misses} stale:{self.stale} "
+                f"failures:{self.failures}")
+
+
+pool: BackendPool | None = None
+
+
 async def handler(fe_read: asyncio.StreamReader,
                   fe_write: asyncio.StreamWriter) -> None:
     peer = ":".join(str(tok) for tok in fe_write.get_extra_info("peername"))
@@ -78,21 +255,40 @@ async def handler(fe_read: asyncio.StreamReader,
     bogus = BogusCoin(log)
     log.info("connected")
 
-    log.info(f"connect to the backend: {be_address}:{be_port}")
-    be_read, be_write = await asyncio.open_connection(be_address, be_port)
+    try:
+        be_read, be_write = await (pool.acquire()
+                                   if pool else connect_backend())
+
+    except (OSError, asyncio.TimeoutError) as e:
+        log.error(f"backend {be_address}:{be_port}: {e!r}")
+        fe_write.close()
+        return
 
-    close_event = asyncio.Event()
+    log.info(f"connected to the backend: {be_address}:{be_port}")
+    if pool:
+        log.info(f"backend pool: {pool}")
+
+    # handle both inbound and outbound sides of the full proxy.
+    tasks = [
+        asyncio.create_task(bogus.handle(fe_read, be_write)),
+        asyncio.create_task(bogus.handle(be_read, fe_write)),
+    ]
 
     try:
-        # handle both inbound and outbound sides of the full proxy.
-        await asyncio.gather(bogus.handle(fe_read, be_write, close_event),
-                             bogus.handle(be_read, fe_write, close_event))
+        # either side closing ends the session, so the reader of the other
+        # side is cancelled straight away instead of polling for it.
+        done, _ = await asyncio.wait(tasks,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
 
     except Exception as e:
         log.error(f"error: {e}")
 
     finally:
-        close_event.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
         log.info("disconnected")
         fe_write.close()
@@ -101,13 +297,26 @@ async def handler(fe_read: asyncio.StreamReader,
 
 
 async def main() -> None:
+    global pool
+
+    refill = None
+    if be_pool_size > 0:
+        pool = BackendPool(be_pool_size, logging.getLogger("pool"))
+        refill = asyncio.create_task(pool.run())
+
     server = await asyncio.start_server(handler, address, port)
     addr = ", ".join(str(sock.getsockname()) for sock in server.sockets)
 
     print(f"Listening on {addr}")
 
-    async with server:
-        await server.serve_forever()
+    try:
+        async with server:
+            await server.serve_forever()
+
+    finally:
+        if refill and pool:
+            refill.cancel()
+            pool.close()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,13 @@
 import asyncio
+import bisect
+import collections
 import logging
 import os
 import struct
 import sys
 import math
 
+from array import array
 from typing import Self
 from enum import IntEnum
 
@@ -16,12 +19,77 @@ logging.basicConfig(
 
 address = os.getenv("SOCKET_ADDRESS", "0.0.0.0")
 port = int(os.getenv("TCP_PORT", "8080"))
-
-Reading = tuple[int, int]
-issued_tickets: dict[int, list['Ticket']] = {}
-plate_readings: dict[str, list[Reading]] = {}
-ticket_days: dict[bytes, set[int]] = {}
+# eviction of readings that can no longer be part of a ticket, off if 0.
+# Readings are assumed to arrive at most this many seconds behind the latest
+# one, and every road also keeps the time it takes to drive the longest road
+# (65535 miles) at its limit.
+retention = int(os.getenv("SPEED_RETENTION", "0"))
+# seconds between sweeps of the expired state
+sweep_interval = float(os.getenv("SPEED_SWEEP_INTERVAL", "60"))
+
+ReadingKey = tuple[bytes, int]  # plate, road
+issued_tickets: dict[int, collections.deque['Ticket']] = {}
+# readings of a plate on a road in time order, packed as timestamp << 16 |
+# mile.
+plate_readings: dict[ReadingKey, 'array[int]'] = {}
+ticket_days: dict[bytes, 'TicketDays'] = {}
 dispatchers: dict[int, asyncio.StreamWriter] = {}
+# lowest speed limit of the cameras of a road
+road_limits: dict[int, int] = {}
+latest_timestamp = 0
+
+
+def insert_reading(readings: 'array[int]', mile: int, timestamp: int) -> int:
+    """adds a reading in time order (after the ones of the same time),
+    returns its position"""
+    pos = bisect.bisect_right(readings, timestamp << 16 | 0xffff)
+    readings.insert(pos, timestamp << 16 | mile)
+    return pos
+
+
+def expire_readings(readings: 'array[int]', cutoff: int,
+                    days: 'TicketDays | None') -> 'array[int]':
+    # readings before the cutoff are dropped, and so are readings on days
+    # the plate was ticketed on: every pair that includes one or spans one
+    # covers that day, so it could never produce a ticket.
+    del readings[:bisect.bisect_left(readings, cutoff << 16)]
+
+    if days:
+        keep = array("Q", (reading for reading in readings
+                           if not days.contains((reading >> 16) // 86400)))
+        if len(keep) < len(readings):
+            return keep
+
+    return readings
+
+
+class TicketDays:
+    """days a plate was ticketed on, as sorted disjoint day intervals"""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self) -> None:
+        self.starts = array("I")
+        self.ends = array("I")
+
+    def overlaps(self, day1: int, day2: int) -> bool:
+        # the intervals are disjoint, so only the last one starting on or
+        # before day2 can reach day1.
+        idx = bisect.bisect_right(self.starts, day2)
+        return idx > 0 and self.ends[idx - 1] >= day1
+
+    def contains(self, day: int) -> bool:
+        return self.overlaps(day, day)
+
+    def add(self, day1: int, day2: int) -> None:
+        idx = bisect.bisect_right(self.starts, day2)
+        self.starts.insert(idx, day1)
+        self.ends.insert(idx, day2)
+
+    def expire(self, day: int) -> None:
+        idx = bisect.bisect_left(self.ends, day)
+        del self.starts[:idx]
+        del self.ends[:idx]
 
 
 class MsgType(IntEnum):
@@ -208,8 +276,8 @@ class Session:
             raise SpeedError(
                 'No cameras has been registered yet for this road')
 
-        self.register_plate(plate.plate, plate.timestamp)
-        self.issue_tickets(plate.plate)
+        pos = self.register_plate(plate.plate, plate.timestamp)
+        self.issue_tickets(plate.plate, pos)
         await self.send_tickets(self.camera.road)
 
     async def handle_camera(self, camera: Camera) -> None:
@@ -225,31 +293,40 @@ class Session:
             self.register_dispatcher(road, self.writer)
             await self.send_tickets(road)
 
-    def gen_key(self, plate: bytes) -> str:
+    def gen_key(self, plate: bytes) -> ReadingKey:
         assert (self.camera is not None)
-        return f"{plate.decode()}::{self.camera.road}"
+        return plate, self.camera.road
 
-    def register_plate(self, plate: bytes, timestamp: int) -> None:
+    def register_plate(self, plate: bytes, timestamp: int) -> int:
+        """adds the reading in time order, returns its position"""
+        global latest_timestamp
         assert (self.camera is not None)
         key = self.gen_key(plate)
         road, mile = self.camera.road, self.camera.mile
-        plate_readings.setdefault(key, []).append((mile, timestamp))
+        records = plate_readings.get(key)
+        if records is None:
+            records = plate_readings[key] = array("Q")
+        pos = insert_reading(records, mile, timestamp)
+        latest_timestamp = max(latest_timestamp, timestamp)
+        road_limits[road] = min(road_limits.get(road, self.camera.limit),
+                                self.camera.limit)
 
         self.log.info(f"Registering plate {plate.decode()} for road {road}: "
                       f"[mile: {mile}, time: {timestamp}]")
+        return pos
 
-    def issue_tickets(self, plate: bytes) -> None:
+    def issue_tickets(self, plate: bytes, pos: int) -> None:
         if not self.camera:
             raise SpeedError("camera is not set")
 
         key = self.gen_key(plate)
+        records = plate_readings[key]
 
-        records = plate_readings.setdefault(key, [])
-        if len(records) > 1:
-            records.sort(key=lambda a: a[1])
-
-        for i, j in enumerate(range(1, len(records))):
-            (mile1, ts1), (mile2, ts2) = records[i], records[j]
+        # all the other adjacent pairs were checked when they became
+        # adjacent, so only the neighbours of the new reading are left.
+        for i in range(max(pos - 1, 0), min(pos + 1, len(records) - 1)):
+            mile1, ts1 = records[i] & 0xffff, records[i] >> 16
+            mile2, ts2 = records[i + 1] & 0xffff, records[i + 1] >> 16
             distance = abs(mile2 - mile1)
             time = ts2 - ts1
             if time == 0:
@@ -270,18 +347,20 @@ class Session:
     def track_ticket(self, ticket: Ticket) -> None:
         day1 = ticket.timestamp1 // 86400
         day2 = ticket.timestamp2 // 86400
-        for i in range(day1, day2 + 1):
-            if i in ticket_days.setdefault(ticket.plate, set()):
-                self.log.info(
-                    f"{ticket.plate.decode()} has already been ticketed "
-                    f"on the {i} day")
-                return
+        days = ticket_days.get(ticket.plate)
+        if days is None:
+            days = ticket_days[ticket.plate] = TicketDays()
 
-        for i in range(day1, day2 + 1):
-            ticket_days[ticket.plate].add(i)
+        if days.overlaps(day1, day2):
+            self.log.info(f"{ticket.plate.decode()} has already been ticketed "
+                          f"on a day between {day1} and {day2}")
+            return
+
+        days.add(day1, day2)
 
         # add ticket
-        issued_tickets.setdefault(ticket.road, []).append(ticket)
+        issued_tickets.setdefault(ticket.road,
+                                  collections.deque()).append(ticket)
 
     async def send_tickets(self, road: int) -> None:
         if road not in dispatchers:
@@ -289,12 +368,15 @@ class Session:
             return
 
         writer = dispatchers[road]
-        tickets = issued_tickets.get(road, [])
+        tickets = issued_tickets.get(road, collections.deque())
 
         while len(tickets) > 0:
-            ticket = tickets.pop(0)
+            ticket = tickets.popleft()
             await ticket.write_to(writer)
 
+        if issued_tickets.get(road) is tickets:
+            del issued_tickets[road]
+
     def register_dispatcher(self, road: int,
                             writer: asyncio.StreamWriter) -> None:
         dispatchers[road] = writer
@@ -322,14 +404,64 @@ async def handler(reader: asyncio.StreamReader,
         writer.close()
 
 
+def expiry(road: int) -> int:
+    """time before which a reading on the road can not be part of a ticket
+    with a reading that is still to come"""
+    limit = road_limits.get(road, 0)
+    if not retention or not limit:
+        return 0
+
+    # slower than the limit even over the longest road
+    horizon = 65535 * 3600 // limit + 1
+    return max(latest_timestamp - retention - horizon, 0)
+
+
+def sweep() -> None:
+    """evicts the readings and ticket days that can not be used anymore"""
+    # plates without readings only get tickets for readings still to come.
+    default = max(latest_timestamp - retention, 0) if retention else 0
+    cutoffs: dict[bytes, int] = {}
+
+    for key in list(plate_readings):
+        plate, road = key
+        cutoff = expiry(road)
+        cutoffs[plate] = min(cutoffs.get(plate, cutoff), cutoff)
+
+        records = expire_readings(plate_readings[key], cutoff,
+                                  ticket_days.get(plate))
+        if records:
+            plate_readings[key] = records
+        else:
+            del plate_readings[key]
+
+    for plate in list(ticket_days):
+        days = ticket_days[plate]
+        days.expire(cutoffs.get(plate, default) // 86400)
+        if not days.starts:
+            del ticket_days[plate]
+
+
+async def sweep_forever(log: logging.Logger) -> None:
+    while True:
+        await asyncio.sleep(sweep_interval)
+        sweep()
+        log.info(f"readings: {len(plate_readings)} plates/roads, "
+                 f"ticketed plates: {len(ticket_days)}")
+
+
 async def main() -> None:
+    sweeper = asyncio.create_task(sweep_forever(logging.getLogger("sweep")))
     server = await asyncio.start_server(handler, address, port)
     addr = ", ".join(str(sock.getsockname()) for sock in server.sockets)
 
     print(f"Listening on {addr}")
 
-    async with server:
-        await server.serve_forever()
+    try:
+        async with server:
+            await server.serve_forever()
+
+    finally:
+        sweeper.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+import task01
+import task01_codec
+import asyncio
+import json
+import logging
+import multiprocessing
+import sys
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+
+logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+
+
+class Task01Test(unittest.TestCase):
+
+    def test_is_prime_small(self) -> None:
+        primes = [n for n in range(200) if task01.is_prime(n)]
+        expected = [
+            n for n in range(2, 200)
+            if all(n % d != 0 for d in range(2, n))
+        ]
+        self.assertEqual(primes, expected)
+
+    def test_is_prime_negative(self) -> None:
+        self.assertFalse(task01.is_prime(-7))
+
+    def test_is_prime_64bit(self) -> None:
+        self.assertTrue(task01.is_prime(18446744073709551557))
+        self.assertTrue(task01.is_prime(9223372036854775783))
+        # strong pseudoprime to bases 2..37
+        self.assertFalse(task01.is_prime(318665857834031151167461))
+        self.assertFalse(task01.is_prime(4294967291 * 4294967279))
+
+    def test_is_prime_huge(self) -> None:
+        self.assertTrue(task01.is_prime(2**521 - 1))
+        self.assertFalse(task01.is_prime((2**521 - 1) * (2**127 - 1)))
+
+    def test_is_prime_float(self) -> None:
+        self.assertTrue(task01.is_prime(7.0))
+        self.assertFalse(task01.is_prime(7.5))
+        self.assertFalse(task01.is_prime(float("inf")))
+        self.assertFalse(task01.is_prime(float("nan")))
+
+    def test_parse_message(self) -> None:
+        num = task01.parse_message(b'{"method":"isPrime","number":123}\n')
+        self.assertEqual(num, 123)
+
+        num = task01.parse_message(b'{"method":"isPrime","number":1.5}\n')
+        self.assertEqual(num, 1.5)
+
+    def test_parse_message_invalid(self) -> None:
+        for line in [
+                b'{"method":"isPrime"}', b'{"method":"foo","number":1}',
+                b'{"method":"isPrime","number":"1"}', b'[1, 2]', b'\xff',
+                b'{"method":"isPrime","number":' + b'9' * 5000 + b'}'
+        ]:
+            with self.assertRaises(task01.InvalidRequestError):
+                task01.parse_message(line)
+
+    def test_sieve(self) -> None:
+        sieve = task01.PrimeSieve(10000)
+        for n in range(-5, 10000):
+            self.assertEqual(sieve.is_prime(n), task01.is_prime(n), n)
+
+    def test_primes_cache(self) -> None:
+        primes = task01.Primes(100, 2)
+        self.assertTrue(primes.is_prime(97))
+        self.assertTrue(primes.is_prime(101))
+        self.assertFalse(primes.is_prime(111))
+        self.assertTrue(primes.is_prime(101.0))
+        self.assertFalse(primes.is_prime(113.5))
+        self.assertEqual((primes.cache.hits, primes.cache.misses), (1, 2))
+
+        # 111 is the least recently used entry
+        self.assertTrue(primes.is_prime(113))
+        self.assertEqual(list(primes.cache.results), [101, 113])
+
+    def test_primes_shared_check(self) -> None:
+        primes = task01.Primes(100, 2)
+        num = 2**521 - 1
+
+        async def check() -> list[bool]:
+            first = asyncio.create_task(primes.check(num, asyncio.Semaphore()))
+            await asyncio.sleep(0)
+            others = [
+                asyncio.create_task(primes.check(num, asyncio.Semaphore()))
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            self.assertEqual(primes.waiters, {num: 2})
+
+            # the waiters start their own check instead of being cancelled.
+            first.cancel()
+            return await asyncio.gather(*others)
+
+        self.addCleanup(setattr, task01, "pool", task01.pool)
+        with ProcessPoolExecutor(max_workers=1) as task01.pool:
+            self.assertEqual(asyncio.run(check()), [True, True])
+
+        self.assertEqual((primes.pending, primes.waiters), ({}, {}))
+
+    def exchange(self, data: bytes) -> list[bool | str]:
+        # the responses of the batched handler to data sent in one write,
+        # as True/False or the error message.
+
+        async def run() -> bytes:
+            server = await asyncio.start_server(task01.prime_batched,
+                                                "127.0.0.1", 0)
+            reader, writer = await asyncio.open_connection(
+                *server.sockets[0].getsockname())
+            writer.write(data)
+            writer.write_eof()
+            out = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return out
+
+        responses: list[bool | str] = []
+        for line in asyncio.run(run()).splitlines():
+            res = json.loads(line)
+            responses.append(res.get("prime", res.get("error")))
+        return responses
+
+    def request(self, num: int | float) -> bytes:
+        return b'{"method":"isPrime","number":%s}\n' % str(num).encode()
+
+    def test_batched(self) -> None:
+        # the last line is complete at eof even without a newline.
+        data = b"".join(self.request(n) for n in [2, 4, 7.0, 1.5, 97])
+        self.assertEqual(self.exchange(data[:-1]),
+                         [True, False, True, False, True])
+
+    def test_batched_malformed(self) -> None:
+        # nothing is answered after the error.
+        data = self.request(7) + b"not json\n" + self.request(11)
+        responses = self.exchange(data)
+        self.assertEqual(responses[0], True)
+        self.assertEqual(len(responses), 2)
+        self.assertIsInstance(responses[1], str)
+
+    def test_batched_too_long(self) -> None:
+        self.addCleanup(setattr, task01, "line_limit", task01.line_limit)
+        task01.line_limit = 64
+        data = self.request(7) + b" " * 100
+        self.assertEqual(self.exchange(data), [True, "request is too long"])
+
+    def test_batched_pool(self) -> None:
+        nums = [2**521 - 1, 4, (2**521 - 1) * 3, 2**127 - 1, 9]
+        self.addCleanup(setattr, task01, "pool", task01.pool)
+        # forked workers would keep the client connection open.
+        ctx = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as task01.pool:
+            responses = self.exchange(b"".join(map(self.request, nums)))
+
+        self.assertEqual(responses, [True, False, False, True, False])
+
+    def test_parse_message_fast_path(self) -> None:
+        for line in [
+                b'{"method":"isPrime","number":0}\n',
+                b'{"method":"isPrime","number":-17}',
+                b' { "method" : "isPrime" , "number" : 123456789012345678 }',
+                b'{"method":"isPrime","number":1234567890123456789}',
+                b'{"method":"isPrime","number":7,"extra":1}',
+                b'{"number":7,"method":"isPrime"}',
+                b'{"method":"isPrime","number":7,"number":8}',
+                b'{"method":"isPrime","number":1e3}',
+        ]:
+            self.assertEqual(task01_codec.parse_message(line),
+                             task01_codec.parse_json(line), line)
+
+        with self.assertRaises(task01.InvalidRequestError):
+            task01_codec.parse_message(b'{"method":"isPrime","number":07}')
+
+    def test_responses(self) -> None:
+        self.assertEqual(json.loads(task01_codec.get_response(True)), {
+            "method": "isPrime",
+            "prime": True
+        })
+        self.assertEqual(json.loads(task01_codec.get_error('a "b"')), {
+            "method": "error",
+            "error": 'a "b"'
+        })
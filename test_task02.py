@@ -0,0 +1,151 @@
+import task02
+import asyncio
+import logging
+import random
+import sys
+import unittest
+
+from typing import cast
+
+logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+
+
+class Writer:
+    """records what the handler writes"""
+
+    def __init__(self) -> None:
+        self.writes: list[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.writes.append(data)
+
+    async def drain(self) -> None:
+        pass
+
+
+class Task02Test(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.index = task02.PriceIndex()
+        self.records: list[tuple[int, int]] = []
+
+    def tearDown(self) -> None:
+        self.index.close()
+
+    def insert(self, time: int, price: int) -> None:
+        self.index.insert(time, price)
+        self.records.append((time, price))
+
+    def assertQuery(self, mintime: int, maxtime: int) -> None:
+        prices = [p for (t, p) in self.records if mintime <= t <= maxtime]
+        self.assertEqual(self.index.query(mintime, maxtime),
+                         (sum(prices), len(prices)), (mintime, maxtime))
+
+    def test_empty(self) -> None:
+        self.assertEqual(self.index.query(0, 100), (0, 0))
+
+    def test_example(self) -> None:
+        for time, price in [(12345, 101), (12346, 102), (12347, 100),
+                            (40960, 5)]:
+            self.insert(time, price)
+        self.assertEqual(self.index.query(12288, 16384), (303, 3))
+        self.assertEqual(self.index.query(16384, 12288), (0, 0))
+
+    def test_out_of_order(self) -> None:
+        random.seed(2)
+        for _ in range(5000):
+            self.insert(random.randrange(-2**31, 2**31),
+                        random.randrange(-2**31, 2**31))
+        self.assertEqual(len(self.index), 5000)
+        self.assertGreater(len(self.index.blocks), 1)
+
+        times = sorted(t for (t, _) in self.records)
+        for _ in range(200):
+            lo, hi = sorted(random.sample(times, 2))
+            self.assertQuery(lo, hi)
+            self.assertQuery(lo + 1, hi - 1)
+        self.assertQuery(-2**31, 2**31 - 1)
+
+    def test_duplicates(self) -> None:
+        for i in range(3000):
+            self.insert(i % 7, i)
+        for lo in range(-1, 8):
+            for hi in range(lo, 9):
+                self.assertQuery(lo, hi)
+
+    def handle(self, data: bytes, size: int, writer: Writer) -> None:
+        # feeds data to the handler in chunks of size, one chunk per read.
+        price = task02.Price("test", logging.getLogger("test"))
+        self.addCleanup(price.index.close)
+
+        async def feed(reader: asyncio.StreamReader) -> None:
+            for i in range(0, len(data), size):
+                reader.feed_data(data[i:i + size])
+                await asyncio.sleep(0)
+            reader.feed_eof()
+
+        async def run() -> None:
+            reader = asyncio.StreamReader()
+            feeder = asyncio.create_task(feed(reader))
+            try:
+                await price.handle(reader,
+                                   cast(asyncio.StreamWriter, writer))
+            finally:
+                await feeder
+
+        asyncio.run(run())
+
+    def test_handle_chunks(self) -> None:
+        random.seed(10)
+        data = bytearray()
+        means: list[int] = []
+        for _ in range(300):
+            if random.random() < 0.7:
+                time, price = random.randrange(1000), random.randint(-99, 99)
+                data += task02.message.pack(task02.TYPE_INSERT, time, price)
+                self.records.append((time, price))
+            else:
+                lo, hi = random.randrange(1000), random.randrange(1000)
+                data += task02.message.pack(task02.TYPE_QUERY, lo, hi)
+                prices = [p for (t, p) in self.records if lo <= t <= hi]
+                means.append(int(sum(prices) / len(prices)) if prices else 0)
+
+        expected = b"".join(task02.mean_struct.pack(m) for m in means)
+        for size in [1, 4, 13]:
+            writer = Writer()
+            self.handle(bytes(data), size, writer)
+            self.assertEqual(b"".join(writer.writes), expected, size)
+
+    def test_handle_coalesced(self) -> None:
+        data = task02.message.pack(task02.TYPE_INSERT, 1, 10)
+        data += task02.message.pack(task02.TYPE_QUERY, 0, 1) * 3
+        writer = Writer()
+        self.handle(data, len(data), writer)
+        self.assertEqual(writer.writes, [task02.mean_struct.pack(10) * 3])
+
+    def test_handle_invalid_type(self) -> None:
+        # the responses before the invalid message are still sent.
+        data = task02.message.pack(task02.TYPE_INSERT, 1, 10)
+        data += task02.message.pack(task02.TYPE_QUERY, 0, 1)
+        data += task02.message.pack(b"X", 0, 0)
+        data += task02.message.pack(task02.TYPE_QUERY, 0, 1)
+        writer = Writer()
+        with self.assertRaises(ValueError):
+            self.handle(data, len(data), writer)
+        self.assertEqual(writer.writes, [task02.mean_struct.pack(10)])
+
+    def test_spill(self) -> None:
+        self.index = task02.PriceIndex(spill_records=3000)
+        random.seed(3)
+        for i in range(6000):
+            self.insert(random.randrange(100000), i)
+            if i == 2000:
+                self.assertEqual(self.index.memory()[1], 0)
+
+        heap, mapped = self.index.memory()
+        self.assertEqual(heap, 0)
+        self.assertEqual(mapped,
+                         len(self.index.blocks) * task02.Block.size)
+
+        for lo in range(0, 100000, 7919):
+            self.assertQuery(lo, lo + 20000)
@@ -0,0 +1,190 @@
+import task03
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+
+Frame = tuple[bytes, bytes, bytes]
+Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class Task03Test(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.log = logging.getLogger("test")
+        task03.chat.clear()
+
+    def patch(self, name: str, value: object) -> None:
+        self.addCleanup(setattr, task03, name, getattr(task03, name))
+        setattr(task03, name, value)
+
+    async def client(self) -> tuple[task03.Client, Connection]:
+        # a client writing to one end of a socket pair, and the other end.
+        ours, theirs = socket.socketpair()
+        _, writer = await asyncio.open_connection(sock=ours)
+        peer = await asyncio.open_connection(sock=theirs)
+
+        client = task03.Client(self.log)
+        client.name = "alice"
+        client.writer = writer
+        client.sock = None
+        return client, peer
+
+    def test_send_drop(self) -> None:
+        self.patch("queue_size", 2)
+        self.patch("overflow_policy", "drop")
+
+        async def run() -> None:
+            client, (_, peer) = await self.client()
+            for i in range(5):
+                client.send(f"{i}\n".encode())
+
+            self.assertFalse(client.closing)
+            self.assertEqual(client.queue.qsize(), 2)
+            self.assertEqual((client.max_depth, client.dropped), (2, 3))
+            client.writer.close()
+            peer.close()
+
+        asyncio.run(run())
+
+    def test_send_disconnect(self) -> None:
+        self.patch("queue_size", 2)
+        self.patch("overflow_policy", "disconnect")
+
+        async def run() -> None:
+            client, (reader, peer) = await self.client()
+            client.sender = asyncio.create_task(client.send_loop())
+            for i in range(3):
+                client.send(f"{i}\n".encode())
+
+            self.assertTrue(client.closing)
+            self.assertTrue(client.writer.transport.is_closing())
+            self.assertEqual((client.max_depth, client.dropped), (2, 0))
+
+            # the connection is aborted with the queued messages unsent.
+            client.send(b"after\n")
+            self.assertEqual(client.queue.qsize(), 2)
+            self.assertEqual(await reader.read(), b"")
+            await asyncio.gather(client.sender, return_exceptions=True)
+            self.assertEqual(client.sent, 0)
+            peer.close()
+
+        asyncio.run(run())
+
+    def test_send_coalesced(self) -> None:
+
+        async def run() -> None:
+            client, (reader, peer) = await self.client()
+            for i in range(3):
+                client.send(f"{i}\n".encode())
+
+            # everything queued before the sender runs is one write.
+            client.sender = asyncio.create_task(client.send_loop())
+            self.assertEqual(await reader.readexactly(6), b"0\n1\n2\n")
+            client.send(b"3\n")
+            self.assertEqual(await reader.readline(), b"3\n")
+            self.assertEqual((client.sent, client.writes), (4, 2))
+
+            client.close()
+            client.writer.close()
+            peer.close()
+
+        asyncio.run(run())
+
+    def test_hub(self) -> None:
+        hub = task03.Hub(self.log)
+
+        async def expect(reader: asyncio.StreamReader,
+                         frames: list[Frame]) -> None:
+            for frame in frames:
+                self.assertEqual(await task03.read_frame(reader), frame)
+
+        async def run(path: str) -> None:
+            server = await asyncio.start_unix_server(hub.handle, path)
+            reader1, writer1 = await asyncio.open_unix_connection(path)
+            reader2, writer2 = await asyncio.open_unix_connection(path)
+            while len(hub.workers) < 2:
+                await asyncio.sleep(0.01)
+
+            task03.write_frame(writer1, task03.FRAME_JOIN, b"alice")
+            await expect(reader1, [
+                (task03.FRAME_JOINED, b"alice", b"* room contains: \n"),
+                (task03.FRAME_DELIVER, b"alice",
+                 b"* alice has entered the room\n"),
+            ])
+
+            task03.write_frame(writer2, task03.FRAME_JOIN, b"alice")
+            task03.write_frame(writer2, task03.FRAME_JOIN, b"bob")
+            task03.write_frame(writer2, task03.FRAME_MESSAGE, b"bob",
+                               b"[bob] hi\n")
+            task03.write_frame(writer2, task03.FRAME_LEAVE, b"bob")
+            bob = [
+                (task03.FRAME_DELIVER, b"bob",
+                 b"* bob has entered the room\n"),
+                (task03.FRAME_DELIVER, b"bob", b"[bob] hi\n"),
+                (task03.FRAME_DELIVER, b"bob", b"* bob has left the room\n"),
+            ]
+            await expect(reader2, [
+                (task03.FRAME_DELIVER, b"alice",
+                 b"* alice has entered the room\n"),
+                (task03.FRAME_DUPLICATE, b"alice", b""),
+                (task03.FRAME_JOINED, b"bob", b"* room contains: alice\n"),
+            ] + bob)
+            await expect(reader1, bob)
+
+            # the members of a worker leave with it.
+            writer1.close()
+            await expect(reader2, [
+                (task03.FRAME_DELIVER, b"alice",
+                 b"* alice has left the room\n"),
+            ])
+            self.assertEqual(hub.members, {})
+
+            writer2.close()
+            while hub.workers:
+                await asyncio.sleep(0.01)
+            server.close()
+            await server.wait_closed()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(run(os.path.join(tmp, "bus.sock")))
+
+    def test_bus_join_cancelled(self) -> None:
+
+        async def run() -> None:
+            ours, theirs = socket.socketpair()
+            bus = task03.BusRoom(*await asyncio.open_connection(sock=ours))
+            hub_reader, hub_writer = await asyncio.open_connection(
+                sock=theirs)
+            runner = asyncio.create_task(bus.run())
+
+            client = task03.Client(self.log)
+            client.name = "alice"
+            join = asyncio.create_task(bus.join(client))
+            self.assertEqual(await task03.read_frame(hub_reader),
+                             (task03.FRAME_JOIN, b"alice", b""))
+            join.cancel()
+            await asyncio.gather(join, return_exceptions=True)
+
+            # the hub's late reply releases the name again.
+            task03.write_frame(hub_writer, task03.FRAME_JOINED, b"alice",
+                               b"* room contains: \n")
+            self.assertEqual(await task03.read_frame(hub_reader),
+                             (task03.FRAME_LEAVE, b"alice", b""))
+            self.assertEqual((task03.chat, bus.pending), ({}, {}))
+
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+            bus.writer.close()
+            hub_writer.close()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
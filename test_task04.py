@@ -0,0 +1,220 @@
+import task04
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import unittest
+import zlib
+
+logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+
+
+class Task04Test(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.log = logging.getLogger("test")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def reopen(self, journal: task04.Journal) -> dict[bytes, bytes]:
+        journal.close()
+        journal = task04.Journal(self.dir.name, self.log)
+        store = journal.recover()
+        journal.close()
+        return store
+
+    def test_handle(self) -> None:
+        db = task04.UnusualDB(self.log)
+        addr = ("127.0.0.1", 1234)
+
+        self.assertIsNone(db.handle(b"foo=bar", addr))
+        self.assertEqual(db.handle(b"foo", addr), b"foo=bar")
+        self.assertIsNone(db.handle(b"foo=bar=baz", addr))
+        self.assertEqual(db.handle(b"foo", addr), b"foo=bar=baz")
+        self.assertIsNone(db.handle(b"foo=", addr))
+        self.assertEqual(db.handle(b"foo", addr), b"foo=")
+        self.assertIsNone(db.handle(b"===", addr))
+        self.assertEqual(db.handle(b"", addr), b"===")
+        self.assertEqual(db.handle(b"missing", addr), b"missing=")
+
+        self.assertEqual(db.handle(b"version", addr),
+                         b"version=Odd database v1.0")
+        self.assertEqual(db.handle(b"version=hacked", addr),
+                         b"version=Odd database v1.0")
+
+    def test_read_ready(self) -> None:
+        self.addCleanup(setattr, task04, "recv_batch", task04.recv_batch)
+        task04.recv_batch = 4
+        db = task04.UnusualDB(self.log)
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            server.bind(("127.0.0.1", 0))
+            server.setblocking(False)
+            client.setblocking(False)
+            for data in [b"a=1", b"b=2", b"a", b"b", b"c"]:
+                client.sendto(data, server.getsockname())
+
+            # one wakeup drains at most recv_batch datagrams.
+            db.read_ready(server)
+            self.assertEqual(client.recv(1024), b"a=1")
+            self.assertEqual(client.recv(1024), b"b=2")
+            self.assertRaises(BlockingIOError, client.recv, 1024)
+
+            # the rest, then stops at EAGAIN with nothing left to read.
+            db.read_ready(server)
+            self.assertEqual(client.recv(1024), b"c=")
+            db.read_ready(server)
+            self.assertRaises(BlockingIOError, client.recv, 1024)
+
+    def test_store_accounting(self) -> None:
+        store = task04.Store()
+        store.put(b"foo", b"bar")
+        store.put(b"foo", b"barbaz")
+        store.put(b"k", b"")
+        store.put(b"version", b"hacked")
+        self.assertEqual(store.bytes, 10)
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get(b"version"))
+
+    def test_store_lru(self) -> None:
+        store = task04.Store(budget=40, policy="lru")
+        for i in range(4):
+            store.put(f"key{i}".encode(), b"0123456")  # 11 bytes
+
+        self.assertEqual(store.get(b"key0"), None)
+        self.assertEqual(store.evictions, 1)
+
+        store.get(b"key1")
+        store.put(b"key4", b"0123456")
+        self.assertEqual(sorted(store.data), [b"key1", b"key3", b"key4"])
+        self.assertEqual(store.bytes, 33)
+        self.assertEqual(store.evicted_bytes, 22)
+
+    def test_store_lfu(self) -> None:
+        random.seed(4)
+        store = task04.Store(budget=1100, policy="lfu")
+        for _ in range(1000):
+            store.get(b"hot")
+            store.put(b"hot", b"x" * 97)
+
+        for i in range(1000):
+            store.put(f"cold{i:03d}".encode(), b"x" * 93)
+
+        self.assertLessEqual(store.bytes, 1100)
+        self.assertEqual(store.get(b"hot"), b"x" * 97)
+        self.assertEqual(store.bytes, sum(
+            len(k) + len(v) for k, v in store.data.items()))
+
+    def test_shared_table(self) -> None:
+        locks = [multiprocessing.Lock() for _ in range(2)]
+        table = task04.SharedTable(3, locks)
+        other = task04.SharedTable(table.slots, locks, table.shm.name)
+        self.addCleanup(table.shm.unlink)
+        self.addCleanup(table.close)
+        self.addCleanup(other.close)
+        self.assertEqual(table.slots, 4)
+
+        table.put(b"foo", b"bar")
+        self.assertEqual(other.get(b"foo"), b"bar")
+        other.put(b"foo", b"a longer value")
+        self.assertEqual(table.get(b"foo"), b"a longer value")
+        other.put(b"foo", b"")
+        self.assertEqual(table.get(b"foo"), b"")
+
+        for i in range(3):
+            other.put(f"k{i}".encode(), f"v{i}".encode())
+        table.put(b"version", b"hacked")
+        table.put(b"full", b"table")
+        table.put(b"big", b"x" * 1020)
+
+        self.assertEqual([table.get(f"k{i}".encode()) for i in range(3)],
+                         [b"v0", b"v1", b"v2"])
+        self.assertIsNone(table.get(b"version"))
+        self.assertIsNone(table.get(b"full"))
+        self.assertIsNone(table.get(b"missing"))
+        self.assertEqual(table.rejected, 2)
+
+    def test_shared_table_probe_limit(self) -> None:
+        self.addCleanup(setattr, task04.SharedTable, "max_probes",
+                        task04.SharedTable.max_probes)
+        task04.SharedTable.max_probes = 4
+        table = task04.SharedTable(64, [multiprocessing.Lock()])
+        self.addCleanup(table.shm.unlink)
+        self.addCleanup(table.close)
+
+        # keys with the same hash slot, the fifth is past the probe limit.
+        keys = [f"k{i}".encode() for i in range(10000)]
+        keys = [key for key in keys if zlib.crc32(key) & table.mask == 0]
+        for key in keys[:5]:
+            table.put(key, b"v")
+
+        self.assertEqual([table.get(key) for key in keys[:5]],
+                         [b"v"] * 4 + [None])
+        self.assertEqual((table.inserts, table.rejected), (4, 1))
+        table.put(keys[0], b"new")
+        self.assertEqual(table.get(keys[0]), b"new")
+
+    def test_journal_log(self) -> None:
+        journal = task04.Journal(self.dir.name, self.log)
+        store = journal.recover()
+        self.assertEqual(store, {})
+
+        journal.append(b"foo", b"bar")
+        journal.append(b"foo", b"baz")
+        journal.append(b"", b"empty=key")
+        asyncio.run(journal.commit())
+        journal.append(b"uncommitted", b"1")
+
+        self.assertEqual(self.reopen(journal), {
+            b"foo": b"baz",
+            b"": b"empty=key",
+            b"uncommitted": b"1",
+        })
+
+    def test_journal_snapshot(self) -> None:
+        journal = task04.Journal(self.dir.name, self.log)
+        store = journal.recover()
+        for i in range(100):
+            store[f"k{i}".encode()] = f"v{i}".encode()
+            journal.append(f"k{i}".encode(), f"v{i}".encode())
+
+        async def snapshot() -> None:
+            await journal.commit()
+            await journal.snapshot(store)
+
+        asyncio.run(snapshot())
+        journal.append(b"k0", b"new")
+        store[b"k0"] = b"new"
+
+        self.assertEqual(sorted(os.listdir(self.dir.name)),
+                         ["log.00000001", "snapshot"])
+        self.assertEqual(self.reopen(journal), store)
+
+    def test_journal_torn_write(self) -> None:
+        journal = task04.Journal(self.dir.name, self.log)
+        journal.recover()
+        journal.append(b"foo", b"bar")
+        journal.append(b"torn", b"record")
+        journal.close()
+
+        path = journal.log_path(0)
+        os.truncate(path, os.path.getsize(path) - 3)
+
+        journal = task04.Journal(self.dir.name, self.log)
+        self.assertEqual(journal.recover(), {b"foo": b"bar"})
+        journal.append(b"after", b"torn")
+        self.assertEqual(self.reopen(journal), {
+            b"foo": b"bar",
+            b"after": b"torn"
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,31 @@
 import task05
+import asyncio
 import logging
+import random
 import sys
+import time
 import unittest
+from typing import cast
 
 logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
 
 
+class Writer:
+    """records what the handler writes"""
+
+    def __init__(self) -> None:
+        self.writes: list[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.writes.append(data)
+
+    def writelines(self, data: list[bytes]) -> None:
+        self.writes.extend(data)
+
+    async def drain(self) -> None:
+        pass
+
+
 class Task05Test(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -56,3 +76,215 @@ class Task05Test(unittest.TestCase):
                  "qnK6H55xpSjtjGZ-1234 bar")
         res = self.bogus.replace_address(solid)
         self.assertEqual(res, solid)
+
+    def rewrite(self, data: bytes, sizes: list[int]) -> bytes:
+        rewriter = task05.AddressRewriter(task05.BogusCoin.evil_addr.encode())
+        out: list[bytes] = []
+        lo = 0
+        for size in sizes:
+            out.extend(rewriter.feed(data[lo:lo + size]))
+            lo += size
+        out.extend(rewriter.feed(data[lo:]))
+        return b"".join(out)
+
+    def test_rewriter_tests(self) -> None:
+        lines = [
+            "foo7AAAAAAAAAAAAAAAAAAAAAAAAAA",
+            "7AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA",
+            "7AAAAAAAAAAAAAAAAAAAAAAAAAA foo",
+            "foo 7AAAAAAAAAAAAAAAAAAAAAAAAAAA bar",
+            "foo 7AAAAAAAAAAAAAAAAAAAAAAAAAAA 7AAAAAAAAAAAAAAAAAAAAAAAAAAA",
+            "foo 750 Boguscoins bar",
+        ]
+        data = "".join(f"{line}\n" for line in lines).encode()
+        expected = "".join(f"{self.bogus.replace_address(line)}\n"
+                           for line in lines).encode()
+
+        for size in range(1, 40):
+            self.assertEqual(self.rewrite(data, [size] * len(data)),
+                             expected, size)
+
+    def test_rewriter_random(self) -> None:
+        random.seed(5)
+        alphabet = "0123456789abcXYZ[]^_`-"
+        tokens = ["", "foo", "750", "Boguscoins", "7"]
+
+        def token() -> str:
+            if random.random() < 0.5:
+                return random.choice(tokens)
+            length = random.randint(24, 37)
+            return "7" + "".join(
+                random.choice(alphabet) for _ in range(length - 1))
+
+        lines = [
+            " ".join(token() for _ in range(random.randint(1, 6))).rstrip()
+            for _ in range(500)
+        ]
+        data = "".join(f"{line}\n" for line in lines).encode()
+        expected = "".join(f"{self.bogus.replace_address(line)}\n"
+                           for line in lines).encode()
+
+        for _ in range(50):
+            sizes = [random.randint(1, 80) for _ in range(len(data) // 20)]
+            self.assertEqual(self.rewrite(data, sizes), expected)
+        self.assertEqual(self.rewrite(data, []), expected)
+
+    def test_rewriter_long_line(self) -> None:
+        addr = b"7AAAAAAAAAAAAAAAAAAAAAAAAAAA"
+        data = b" ".join([b"x" * 100000, addr, b"y" * 100000, addr]) + b"\n"
+        evil = task05.BogusCoin.evil_addr.encode()
+        self.assertEqual(
+            self.rewrite(data, [4096] * 50),
+            b" ".join([b"x" * 100000, evil, b"y" * 100000, evil]) + b"\n")
+
+        # past the cap only the tail of the token is held back.
+        rewriter = task05.AddressRewriter(evil)
+        self.assertEqual(rewriter.feed(b"x" * 100000), [b"x" * 99964])
+        self.assertEqual(rewriter.line, b"x" * 36)
+
+    async def readline_handle(self, reader: asyncio.StreamReader,
+                              writer: Writer) -> None:
+        # the handler before the rewriter, one readline per line.
+        while True:
+            buf = await reader.readline()
+            if not buf or buf[-1] != ord("\n"):
+                return  # eof
+
+            line = buf.rstrip().decode()
+            writer.write(f"{self.bogus.replace_address(line)}\n".encode())
+
+    def handle(self, data: bytes, size: int) -> tuple[bytes, bytes]:
+        # the output of the old and the new handler, fed in chunks of size.
+        async def run(readline: bool) -> bytes:
+            reader = asyncio.StreamReader()
+            writer = Writer()
+            handle = (self.readline_handle(reader, writer) if readline else
+                      self.bogus.handle(reader,
+                                        cast(asyncio.StreamWriter, writer)))
+            task = asyncio.create_task(handle)
+            for i in range(0, len(data), size):
+                reader.feed_data(data[i:i + size])
+                await asyncio.sleep(0)
+            reader.feed_eof()
+            await task
+            return b"".join(writer.writes)
+
+        return asyncio.run(run(True)), asyncio.run(run(False))
+
+    def test_handle_readline(self) -> None:
+        addr = "7AAAAAAAAAAAAAAAAAAAAAAAAAAA"
+        lines = [
+            f"foo {addr}\r\n",
+            f"{addr}\t\n",
+            f"{addr} \t\r \n",
+            f"{addr}\t{addr}\n",
+            f"{addr}\r{addr} \n",
+            f"  {addr} foo\t\n",
+            " \t\r\n",
+            "\n",
+            f"bar {addr}",
+        ]
+        data = "".join(lines).encode()
+
+        for size in [1, 3, 7, 64]:
+            old, new = self.handle(data, size)
+            self.assertEqual(new, old, size)
+            self.assertNotIn(b"bar", new)
+
+    def test_handle_readline_random(self) -> None:
+        self.addCleanup(setattr, task05, "line_limit", task05.line_limit)
+        task05.line_limit = 40
+        random.seed(21)
+        alphabet = "0123456789abcXYZ-"
+        blanks = [" ", "  ", "\t", " \t", "\r", "\t\r "]
+
+        def token() -> str:
+            length = random.choice([1, 3, 25, 26, 30, 35, 36, 50])
+            return "7" + "".join(
+                random.choice(alphabet) for _ in range(length - 1))
+
+        # lines both shorter and longer than the cap, with trailing blanks.
+        data = "".join(
+            "".join(token() + random.choice(blanks)
+                    for _ in range(random.randint(0, 8))) +
+            random.choice(["", "\r", " \t"]) + "\n"
+            for _ in range(300)).encode()
+
+        for size in [1, 5, 13, 100]:
+            old, new = self.handle(data + b"7 unterminated", size)
+            self.assertEqual(new, old, size)
+
+    def test_backend_pool(self) -> None:
+        self.addCleanup(setattr, task05, "be_address", task05.be_address)
+        self.addCleanup(setattr, task05, "be_port", task05.be_port)
+
+        handlers: list[asyncio.Task[None] | None] = []
+
+        async def backend(reader: asyncio.StreamReader,
+                          writer: asyncio.StreamWriter) -> None:
+            handlers.append(asyncio.current_task())
+            writer.write(b"welcome\n")
+            try:
+                await reader.read()
+            except ConnectionResetError:
+                pass  # closed with the welcome unread
+            writer.close()
+
+        async def run() -> None:
+            server = await asyncio.start_server(backend, "127.0.0.1", 0)
+            task05.be_address, task05.be_port = server.sockets[0].getsockname()
+
+            pool = task05.BackendPool(2, logging.getLogger("test"))
+            refill = asyncio.create_task(pool.run())
+            while len(pool.idle) < 2:
+                await asyncio.sleep(0.01)
+
+            # a connection closed here is replaced, not handed out.
+            pool.idle[0][1].close()
+            conns = [await pool.acquire() for _ in range(3)]
+            for reader, writer in conns:
+                self.assertEqual(await reader.readline(), b"welcome\n")
+                writer.close()
+
+            self.assertEqual((pool.hits, pool.misses, pool.stale), (1, 2, 1))
+
+            refill.cancel()
+            pool.close()
+            server.close()
+            # let the backend see eof on all the connections.
+            await asyncio.gather(*(h for h in handlers if h))
+            await server.wait_closed()
+
+        asyncio.run(run())
+
+    def test_backend_pool_closed_by_backend(self) -> None:
+        self.addCleanup(setattr, task05, "be_address", task05.be_address)
+        self.addCleanup(setattr, task05, "be_port", task05.be_port)
+
+        async def backend(reader: asyncio.StreamReader,
+                          writer: asyncio.StreamWriter) -> None:
+            # the welcome stays unread in the pooled connection.
+            writer.write(b"welcome\n")
+            writer.close()
+
+        async def run() -> None:
+            server = await asyncio.start_server(backend, "127.0.0.1", 0)
+            task05.be_address, task05.be_port = server.sockets[0].getsockname()
+
+            pool = task05.BackendPool(1, logging.getLogger("test"))
+            reader, writer = await task05.connect_backend()
+            pool.idle.append((reader, writer, time.monotonic()))
+            for _ in range(100):
+                if not pool.healthy(*pool.idle[0]):
+                    break
+                await asyncio.sleep(0.01)
+
+            self.assertFalse(reader.at_eof())
+            _, writer = await pool.acquire()
+            writer.close()
+            self.assertEqual((pool.hits, pool.misses, pool.stale), (0, 1, 1))
+
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(run())
@@ -0,0 +1,197 @@
+import task06
+import asyncio
+import logging
+import math
+import random
+import sys
+import unittest
+
+from typing import cast
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+Ticket = tuple[bytes, int, int, int, int, int, int]
+
+
+class Task06Test(unittest.TestCase):
+
+    def setUp(self) -> None:
+        task06.issued_tickets.clear()
+        task06.plate_readings.clear()
+        task06.ticket_days.clear()
+        task06.road_limits.clear()
+        task06.latest_timestamp = 0
+        self.log = logging.getLogger("test")
+        self.log.setLevel(logging.WARNING)
+
+    def camera(self, road: int, mile: int, limit: int) -> task06.Session:
+        # the streams are not used to register readings.
+        session = task06.Session(self.log, asyncio.Event(),
+                                 cast(asyncio.StreamReader, None),
+                                 cast(asyncio.StreamWriter, None))
+        session.camera = task06.Camera(road, mile, limit)
+        return session
+
+    def observe(self, session: task06.Session, plate: bytes,
+                timestamp: int) -> None:
+        pos = session.register_plate(plate, timestamp)
+        session.issue_tickets(plate, pos)
+
+    def tickets(self) -> list[Ticket]:
+        return [(t.plate, t.road, t.mile1, t.timestamp1, t.mile2,
+                 t.timestamp2, t.speed)
+                for tickets in task06.issued_tickets.values()
+                for t in tickets]
+
+    def test_example(self) -> None:
+        self.observe(self.camera(123, 8, 60), b"UN1X", 0)
+        self.observe(self.camera(123, 9, 60), b"UN1X", 45)
+        self.assertEqual(self.tickets(), [(b"UN1X", 123, 8, 0, 9, 45, 8000)])
+
+    def test_out_of_order(self) -> None:
+        self.observe(self.camera(1, 50, 60), b"CAR", 100000)
+        self.observe(self.camera(1, 0, 60), b"CAR", 99000)
+        # the same day has been ticketed already
+        self.observe(self.camera(1, 49, 60), b"CAR", 99100)
+        self.assertEqual(self.tickets(),
+                         [(b"CAR", 1, 0, 99000, 50, 100000, 18000)])
+
+    def test_same_tickets_as_rescan(self) -> None:
+        random.seed(6)
+        limits = {1: 60, 2: 80}
+        observed: list[tuple[int, int, bytes, int]] = []
+
+        for _ in range(400):
+            road = random.choice([1, 2])
+            mile = random.randrange(100)
+            plate = random.choice([b"A", b"B", b"C"])
+            timestamp = random.randrange(86400 * 5)
+            observed.append((road, mile, plate, timestamp))
+            self.observe(self.camera(road, mile, limits[road]), plate,
+                         timestamp)
+
+        self.assertEqual(self.tickets(), self.rescan(observed, limits))
+
+    def test_sweep_ticketed_days(self) -> None:
+        # readings on ticketed days are evicted without changing the
+        # tickets issued.
+        self.addCleanup(setattr, task06, "retention", task06.retention)
+        task06.retention = 0
+        random.seed(7)
+        limits = {1: 60, 2: 80}
+        observed: list[tuple[int, int, bytes, int]] = []
+
+        for i in range(1000):
+            road = random.choice([1, 2])
+            mile = random.randrange(100)
+            plate = random.choice([b"A", b"B", b"C"])
+            timestamp = random.randrange(86400 * 20)
+            observed.append((road, mile, plate, timestamp))
+            self.observe(self.camera(road, mile, limits[road]), plate,
+                         timestamp)
+            if i % 50 == 0:
+                task06.sweep()
+
+        self.assertEqual(self.tickets(), self.rescan(observed, limits))
+        readings = sum(len(r) for r in task06.plate_readings.values())
+        self.assertLess(readings, 1000)
+
+    def test_sweep_retention(self) -> None:
+        self.addCleanup(setattr, task06, "retention", task06.retention)
+        task06.retention = 3600
+        # the longest road takes a bit over an hour at this limit.
+        camera = self.camera(1, 0, 65535)
+        for timestamp in [0, 1000, 9000, 10000]:
+            self.observe(camera, b"SLOW", timestamp)
+        self.observe(self.camera(2, 0, 65535), b"GONE", 10)
+
+        task06.sweep()
+        self.assertEqual(list(task06.plate_readings), [(b"SLOW", 1)])
+        self.assertEqual(
+            [r >> 16 for r in task06.plate_readings[b"SLOW", 1]],
+            [9000, 10000])
+
+    def test_sweep_retention_long_drive(self) -> None:
+        self.addCleanup(setattr, task06, "retention", task06.retention)
+        task06.retention = 86400
+        self.observe(self.camera(1, 0, 60), b"LONG", 0)
+        self.observe(self.camera(1, 10, 60), b"OTHER", 90000)
+        task06.sweep()
+
+        self.observe(self.camera(1, 3000, 60), b"LONG", 100000)
+        self.assertEqual(self.tickets(),
+                         [(b"LONG", 1, 0, 0, 3000, 100000, 10800)])
+
+    def test_sweep_retention_same_tickets(self) -> None:
+        # readings arrive at most a retention period late.
+        self.addCleanup(setattr, task06, "retention", task06.retention)
+        task06.retention = 86400
+        random.seed(25)
+        limits = {1: 60, 2: 1000}
+        observed: list[tuple[int, int, bytes, int]] = []
+
+        for i in range(1000):
+            road = random.choice([1, 2])
+            mile = random.choice([random.randrange(100),
+                                  random.randrange(65536)])
+            plate = random.choice([b"A", b"B", b"C"])
+            timestamp = max(i * 17280 - random.randrange(86400), 0)
+            observed.append((road, mile, plate, timestamp))
+            self.observe(self.camera(road, mile, limits[road]), plate,
+                         timestamp)
+            if i % 50 == 0:
+                task06.sweep()
+
+        self.assertEqual(self.tickets(), self.rescan(observed, limits))
+        readings = sum(len(r) for r in task06.plate_readings.values())
+        self.assertLess(readings, 500)
+
+    def test_ticket_days(self) -> None:
+        days = task06.TicketDays()
+        days.add(5, 7)
+        days.add(1, 1)
+        days.add(10, 10)
+        self.assertEqual(list(days.starts), [1, 5, 10])
+        self.assertTrue(days.overlaps(7, 9))
+        self.assertTrue(days.overlaps(0, 20))
+        self.assertFalse(days.overlaps(2, 4))
+        self.assertFalse(days.overlaps(8, 9))
+        self.assertFalse(days.overlaps(11, 11))
+
+        days.expire(6)
+        self.assertEqual((list(days.starts), list(days.ends)), ([5, 10],
+                                                                [7, 10]))
+
+    def rescan(self, observed: list[tuple[int, int, bytes, int]],
+               limits: dict[int, int]) -> list[Ticket]:
+        # re-sort and check all the adjacent readings on every observation
+        readings: dict[tuple[bytes, int], list[tuple[int, int]]] = {}
+        days: dict[bytes, set[int]] = {}
+        tickets: dict[int, list[Ticket]] = {}
+
+        for road, mile, plate, timestamp in observed:
+            records = readings.setdefault((plate, road), [])
+            records.append((mile, timestamp))
+            records.sort(key=lambda a: a[1])
+
+            for (mile1, ts1), (mile2, ts2) in zip(records, records[1:]):
+                if ts1 == ts2:
+                    continue
+                speed = abs(mile2 - mile1) / (ts2 - ts1) * 3600
+                if speed <= limits[road] + 0.3:
+                    continue
+
+                ticketed = days.setdefault(plate, set())
+                span = set(range(ts1 // 86400, ts2 // 86400 + 1))
+                if ticketed & span:
+                    continue
+                ticketed |= span
+                tickets.setdefault(road, []).append(
+                    (plate, road, mile1, ts1, mile2, ts2,
+                     math.floor(speed * 100)))
+
+        return [ticket for road in tickets for ticket in tickets[road]]
+
+
+if __name__ == "__main__":
+    unittest.main()